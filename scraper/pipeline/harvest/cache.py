@@ -0,0 +1,64 @@
+# pipeline/harvest/cache.py
+from __future__ import annotations
+
+import gzip
+import os
+import threading
+import time
+from typing import Callable, Optional
+from urllib.parse import quote
+
+# Wiki content we scrape changes slowly; a week keeps dev re-runs off the network
+DEFAULT_TTL_S = 7 * 24 * 3600
+
+
+def cache_path(cache_dir: str, key: str) -> str:
+    """Map a cache key (e.g. a page title) to a filesystem-safe gzip file path."""
+    return os.path.join(cache_dir, quote(key, safe="") + ".gz")
+
+
+def cached_text(
+    cache_dir: str,
+    key: str,
+    fetch: Callable[[], Optional[str]],
+    ttl_s: float = DEFAULT_TTL_S,
+) -> Optional[str]:
+    """
+    Return the text cached under `key` if it is younger than `ttl_s`, otherwise call
+    `fetch()` and store a non-empty result gzip-compressed (wiki HTML compresses ~5x).
+    Empty/None results are returned as-is and never cached.
+    """
+    path = cache_path(cache_dir, key)
+    try:
+        if time.time() - os.path.getmtime(path) < ttl_s:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return f.read()
+    except (OSError, EOFError):
+        # Missing, unreadable or truncated entry: fall through and refetch
+        pass
+
+    text = fetch()
+    if text:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    return text
+
+
+def cached_page_html(
+    cache_dir: Optional[str],
+    base_url: str,
+    title: str,
+    fetch: Callable[[], Optional[str]],
+    ttl_s: float = DEFAULT_TTL_S,
+) -> Optional[str]:
+    """
+    Page HTML from `fetch()`, cached under `cache_dir` like cached_text. The key includes
+    the wiki's base URL, so switching WIKI_BASE never serves another wiki's pages.
+    With no cache_dir, `fetch()` is called directly.
+    """
+    if not cache_dir:
+        return fetch()
+    return cached_text(cache_dir, f"{base_url}|{title}|html", fetch, ttl_s)
@@ -4,15 +4,28 @@ from __future__ import annotations
 import time
 import math
 import logging
+import threading
+from functools import lru_cache
 from typing import Dict, Iterable, List, Optional
 from urllib.parse import quote
 
+import orjson
 import requests
 from requests import Response
+from requests.adapters import HTTPAdapter
 
 logger = logging.getLogger(__name__)
 
 
+def _json(resp: Response):
+    """
+    Decode a JSON response. orjson parses the raw (already gunzipped) bytes directly,
+    skipping the text decode step of resp.json(); parse API payloads carry whole pages.
+    Raises orjson.JSONDecodeError (a ValueError) on bad JSON, as resp.json() would.
+    """
+    return orjson.loads(resp.content)
+
+
 class MediaWikiError(RuntimeError):
     """Raised for non-retryable MediaWiki client errors."""
 
@@ -26,8 +39,9 @@ class MediaWikiClient:
       • Fetches rendered article HTML via REST (cleaner than front-end scrape)
       • Pulls sections and basic page info for richer metadata
       • Retries politely and rate-limits (be a good citizen)
+      • Keeps one pooled keep-alive session, so TLS handshakes are paid once
 
-    Dependencies: only `requests`.
+    Dependencies: `requests` and `orjson` (lxml is used when installed).
     """
 
     def __init__(
@@ -35,9 +49,11 @@ class MediaWikiClient:
         base_url: str = "https://genshin-impact.fandom.com",
         user_agent: str = "genshin-rag/1.0 (contact: ajoshuauc@gmail.com)",
         timeout_s: int = 30,
+        connect_timeout_s: float = 5.0,
         max_retries: int = 5,
         rate_limit_rps: float = 2.0,  # gentle
         session: Optional[requests.Session] = None,
+        pool_maxsize: int = 10,
     ):
         if base_url.endswith("/"):
             base_url = base_url[:-1]
@@ -45,12 +61,20 @@ class MediaWikiClient:
         self.api_url = f"{self.base_url}/api.php"
         self.rest_url = f"{self.base_url}/rest.php/v1"
         self.timeout_s = timeout_s
+        self.connect_timeout_s = connect_timeout_s
         self.max_retries = max_retries
         self.rate_limit_rps = rate_limit_rps
         self._min_interval = 1.0 / rate_limit_rps if rate_limit_rps > 0 else 0.0
         self._last_request_ts = 0.0
-
-        self.session = session or requests.Session()
+        self._rate_lock = threading.Lock()
+
+        if session is None:
+            session = requests.Session()
+            # Everything goes to a single host: one pool, sized for concurrent callers
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+        self.session = session
         # Use simple curl-like headers to ensure API returns JSON instead of HTML
         # Default to curl/8.7.1 if user_agent doesn't look like curl
         if "curl" not in user_agent.lower():
@@ -61,16 +85,24 @@ class MediaWikiClient:
             {
                 "User-Agent": default_ua,
                 "Accept": "*/*",
+                "Accept-Encoding": "gzip, deflate",
+                # Explicit so a proxy or caller-supplied session can't downgrade to one-shot connections
+                "Connection": "keep-alive",
             }
         )
 
     # -------------------- Internal HTTP helpers -------------------- #
 
     def _respect_rate_limit(self) -> None:
+        # Thread-safe: each caller reserves the next free request slot under the lock,
+        # then sleeps outside it, so concurrent workers still share one request rate.
         if self._min_interval <= 0:
             return
-        now = time.time()
-        wait = self._min_interval - (now - self._last_request_ts)
+        with self._rate_lock:
+            now = time.time()
+            slot = max(now, self._last_request_ts + self._min_interval)
+            self._last_request_ts = slot
+        wait = slot - now
         if wait > 0:
             time.sleep(wait)
 
@@ -79,8 +111,11 @@ class MediaWikiClient:
         for attempt in range(1, self.max_retries + 1):
             self._respect_rate_limit()
             try:
-                resp = self.session.request(method, url, timeout=self.timeout_s, **kwargs)
-                self._last_request_ts = time.time()
+                # Short connect timeout: a dead connection fails fast and gets retried,
+                # while slow page renders still get the full read timeout
+                resp = self.session.request(
+                    method, url, timeout=(self.connect_timeout_s, self.timeout_s), **kwargs
+                )
 
                 if resp.status_code in (429, 500, 502, 503, 504):
                     backoff = min(20.0, 0.6 * (2 ** (attempt - 1)))
@@ -147,7 +182,7 @@ class MediaWikiClient:
                 p["cmcontinue"] = cmcontinue
 
             resp = self._request("GET", self.api_url, params=p)
-            data = resp.json()
+            data = _json(resp)
 
             members = data.get("query", {}).get("categorymembers", [])
             out.extend(members)
@@ -197,7 +232,7 @@ class MediaWikiClient:
         
         try:
             resp = self._request("GET", self.api_url, params=params)
-            data = resp.json()
+            data = _json(resp)
             
             sections: Dict[str, str] = {}
             parse_data = data.get("parse", {})
@@ -213,44 +248,87 @@ class MediaWikiClient:
         except (MediaWikiError, KeyError, ValueError):
             return None
 
-    def page_section_text_via_api(self, title: str, section_index: str) -> Optional[str]:
+    def _parse_html(self, title: str, section_index: Optional[str] = None) -> Optional[str]:
         """
-        Get a specific section's text via MediaWiki API.
-        Uses action=parse&prop=text&section={index}, parses HTML and returns plain text.
-        
-        Args:
-            title: Page title
-            section_index: Section index (as returned by page_sections_via_api)
-            
-        Returns:
-            Plain text content of the section, or None if not found.
+        action=parse&prop=text for a whole page or a single section, without edit
+        links or TOC. Returns the HTML, or None if not found.
         """
         params = {
             "action": "parse",
             "page": title,
             "prop": "text",
-            "section": section_index,
+            "disableeditsection": "1",
+            "disabletoc": "1",
             "format": "json",
             "formatversion": "2",
         }
-        
+        if section_index is not None:
+            params["section"] = section_index
+
         try:
             resp = self._request("GET", self.api_url, params=params)
-            data = resp.json()
-            
+            data = _json(resp)
+
             parse_data = data.get("parse", {})
             if "missing" in parse_data or "error" in data:
                 return None
-                
-            html = parse_data.get("text", "")
-            if not html:
-                return None
+
+            return parse_data.get("text", "") or None
+        except (MediaWikiError, KeyError, ValueError):
+            return None
+
+    def page_html_via_api(self, title: str) -> Optional[str]:
+        """
+        Get a whole page's rendered HTML via MediaWiki API (action=parse&prop=text).
+        Unlike the REST HTML, headings keep their mw-headline spans and match the
+        section names from page_sections_via_api, so sections can be sliced locally.
+
+        Returns:
+            Page HTML, or None if not found.
+        """
+        return self._parse_html(title)
+
+    def page_section_html_via_api(self, title: str, section_index: str) -> Optional[str]:
+        """
+        Get a specific section's rendered HTML via MediaWiki API.
+        Uses action=parse&prop=text&section={index} without edit links or TOC, so
+        only that section is downloaded instead of the whole article.
+
+        Args:
+            title: Page title
+            section_index: Section index (as returned by page_sections_via_api)
+
+        Returns:
+            Section HTML, or None if not found.
+        """
+        return self._parse_html(title, section_index)
+
+    def page_section_text_via_api(self, title: str, section_index: str) -> Optional[str]:
+        """
+        Get a specific section's text via MediaWiki API.
+        Fetches the section HTML (see page_section_html_via_api) and returns plain text.
+        
+        Args:
+            title: Page title
+            section_index: Section index (as returned by page_sections_via_api)
             
-            from bs4 import BeautifulSoup
-            soup = BeautifulSoup(html, "html.parser")
-            return soup.get_text("\n", strip=True)
-        except (MediaWikiError, KeyError, ValueError, ImportError):
+        Returns:
+            Plain text content of the section, or None if not found.
+        """
+        html = self.page_section_html_via_api(title, section_index)
+        if not html:
+            return None
+
+        try:
+            import lxml.html
+            from scraper.pipeline.harvest.wiki_html import strip_non_text
+        except ImportError:
             return None
+        tree = lxml.html.fragment_fromstring(html, create_parent=True)
+        # Keep the strings BeautifulSoup's get_text("\n", strip=True) keeps: no script,
+        # style or template bodies, no ruby annotations (comments are skipped by itertext)
+        strip_non_text(tree)
+        return "\n".join(part.strip() for part in tree.itertext() if part.strip())
 
     def page_wikitext(self, title: str) -> Optional[str]:
         """
@@ -265,7 +343,7 @@ class MediaWikiClient:
             "titles": title,
         }
         resp = self._request("GET", self.api_url, params=params)
-        data = resp.json()
+        data = _json(resp)
         pages = data.get("query", {}).get("pages", {})
         for _, page in pages.items():
             if "missing" in page:
@@ -283,7 +361,7 @@ class MediaWikiClient:
         """
         params = {"action": "parse", "format": "json", "page": title, "prop": "sections"}
         resp = self._request("GET", self.api_url, params=params)
-        data = resp.json()
+        data = _json(resp)
         parsed = data.get("parse", {})
         return parsed.get("sections", []) or []
 
@@ -300,7 +378,7 @@ class MediaWikiClient:
             "cllimit": "max",
         }
         resp = self._request("GET", self.api_url, params=params)
-        data = resp.json()
+        data = _json(resp)
         pages = data.get("query", {}).get("pages", {})
         for _, page in pages.items():
             return page
@@ -320,8 +398,9 @@ class MediaWikiClient:
         return s[:1].upper() + s[1:] if s else s
 
     @staticmethod
+    @lru_cache(maxsize=8192)
     def canonical_url(base_url: str, title: str) -> str:
-        """Build canonical /wiki/<Title_With_Underscores> URL."""
+        """Build canonical /wiki/<Title_With_Underscores> URL (memoized per base_url/title)."""
         slug = title.replace(" ", "_")
         return f"{base_url}/wiki/{quote(slug)}"
 
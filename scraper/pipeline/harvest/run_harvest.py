@@ -1,8 +1,9 @@
 # pipeline/harvest/run_harvest.py
 from __future__ import annotations
-import os, json, sys
+import os, sys
 from typing import Dict, Set
 from urllib.parse import unquote
+import orjson
 from tqdm import tqdm
 
 # Add project root to path for importing modules
@@ -11,19 +12,7 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from scraper.pipeline.harvest.mediawiki import MediaWikiClient, MediaWikiError
-
-# Helper to find data directory (check scraper/data first, then project_root/data)
-def get_data_dir():
-    """Find the data directory, checking scraper/data first, then project_root/data."""
-    scraper_data = os.path.join(project_root, "scraper", "data")
-    root_data = os.path.join(project_root, "data")
-    if os.path.exists(scraper_data):
-        return scraper_data
-    elif os.path.exists(root_data):
-        return root_data
-    else:
-        # Default to scraper/data if neither exists (will be created)
-        return scraper_data
+from scraper.pipeline.harvest.wiki_html import SKIP_PREFIXES, get_data_dir, upper_first
 
 CATEGORIES: Dict[str, str] = {
     "characters": "Category:Characters",
@@ -47,15 +36,15 @@ def load_processed_titles(out_path: str) -> Set[str]:
     processed = set()
     if os.path.exists(out_path):
         try:
-            with open(out_path, "r", encoding="utf-8") as f:
+            with open(out_path, "rb") as f:
                 for line in f:
                     line = line.strip()
                     if not line:
                         continue
                     try:
-                        rec = json.loads(line)
+                        rec = orjson.loads(line)
                         processed.add(rec["title"])
-                    except (json.JSONDecodeError, KeyError):
+                    except (orjson.JSONDecodeError, KeyError):
                         # Skip malformed lines
                         continue
         except Exception as e:
@@ -74,21 +63,15 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
     titles = set()
     
     # Find all links in the main content area
-    # Handle multiple CSS classes (e.g., "mw-content-ltr mw-parser-output")
-    content_area = (soup.find("div", class_="mw-parser-output") or 
-                    soup.find("div", class_=lambda x: bool(x and ("mw-parser-output" in (x if isinstance(x, str) else " ".join(x) if isinstance(x, list) else str(x))))) or
-                    soup.find("div", id="content"))
+    # Class selectors match a single token, so "mw-content-ltr mw-parser-output" is covered too
+    content_area = soup.select_one("div.mw-parser-output") or soup.select_one("div#content")
     if not content_area:
         return titles
     
     # Find all <a> tags with href attributes pointing to /wiki/ pages
     for link in content_area.find_all("a", href=True):
-        href_attr = link.get("href")
-        # Convert to string if it's a list (BeautifulSoup can return lists)
-        if isinstance(href_attr, list):
-            href = str(href_attr[0]) if href_attr else ""
-        else:
-            href = str(href_attr) if href_attr else ""
+        # href is never multi-valued in BeautifulSoup (only class/rel-style attributes are)
+        href = link.get("href", "") or ""
         
         # Handle relative paths (./), absolute (/wiki/...), and full URLs (https://.../wiki/...)
         wiki_path = None
@@ -105,12 +88,7 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
             continue
         
         # Skip external links, anchors, and special pages
-        if (wiki_path.startswith("/wiki/File:") or 
-            wiki_path.startswith("/wiki/Category:") or 
-            wiki_path.startswith("/wiki/Template:") or
-            wiki_path.startswith("/wiki/User:") or
-            wiki_path.startswith("/wiki/Help:") or
-            wiki_path.startswith("/wiki/Special:")):
+        if wiki_path.startswith(SKIP_PREFIXES):
             continue
         
         # Extract page title from href (e.g., "/wiki/One_Giant_Step_for_Alchemy%3F" -> "One Giant Step for Alchemy?")
@@ -132,7 +110,7 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
         
         # MediaWiki title normalization: first letter uppercase
         if title:
-            title = title[0].upper() + title[1:] if len(title) > 1 else title.upper()
+            title = upper_first(title)
             titles.add(title)
     
     return titles
@@ -168,14 +146,14 @@ def main():
                     print(f"⚠️  Warning: Failed to fetch list page {list_page_title} after retries: {e}")
                     list_page_html = None
                 if list_page_html:
-                    with open(out_path, "a", encoding="utf-8") as f:
+                    with open(out_path, "ab") as f:
                         rec = {
                             "title": list_page_title,
                             "category": key,
                             "url": mw.canonical_url(mw.base_url, list_page_title),
                             "html": list_page_html,
                         }
-                        f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                        f.write(orjson.dumps(rec) + b"\n")
                         f.flush()
                     processed.add(list_page_title)
                     list_page_count = 1
@@ -238,7 +216,7 @@ def main():
         # Append new records
         new_count = list_page_count  # Start with list page count if fetched
         remaining_count = len(remaining)
-        with open(out_path, "a", encoding="utf-8") as f:
+        with open(out_path, "ab") as f:
             for m in tqdm(remaining, desc=f"Processing {key}", total=remaining_count, unit="page"):
                 title = m["title"]
                 try:
@@ -254,7 +232,7 @@ def main():
                     "url": mw.canonical_url(mw.base_url, title),
                     "html": html,
                 }
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                f.write(orjson.dumps(rec) + b"\n")
                 f.flush()  # Ensure data is written immediately
                 new_count += 1
                 
@@ -275,7 +253,7 @@ def main():
                                     "url": mw.canonical_url(mw.base_url, subpage_title),
                                     "html": subpage_html,
                                 }
-                                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                                f.write(orjson.dumps(rec) + b"\n")
                                 f.flush()
                                 processed.add(subpage_title)
                                 new_count += 1
@@ -0,0 +1,319 @@
+# pipeline/harvest/wiki_html.py
+from __future__ import annotations
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Callable, Dict, FrozenSet, Iterable, Iterator, List, Optional, Set, Tuple
+from urllib.parse import unquote
+
+import lxml.etree
+import lxml.html
+import orjson
+
+try:
+    from tqdm import tqdm
+except ImportError:
+    # Fallback if tqdm is not available
+    def tqdm(iterable, *args, **kwargs):
+        return iterable
+    tqdm.write = print
+
+# Shared by the scripts/harvest_* scrapers: data dir lookup, resumable JSONL checkpoints,
+# wiki link → title normalization and the lxml helpers that slice parse-API pages into sections.
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# Namespaces that never hold article pages
+SKIP_NAMESPACES = ("File", "Category", "Template", "User", "Help", "Special", "MediaWiki")
+# str.startswith takes the whole tuple
+SKIP_PREFIXES = tuple(f"/wiki/{namespace}:" for namespace in SKIP_NAMESPACES)
+# The same filter as an XPath predicate for <a>, so libxml2 skips icon/image and other
+# namespace links before Python sees them. Covers the "./" hrefs of REST HTML and
+# "/wiki/" ones; full URLs still go through href_to_title's check.
+ARTICLE_LINK_PREDICATE = "[{}]".format(
+    " and ".join(
+        f'not(starts-with(@href, "{prefix}{namespace}:"))'
+        for namespace in SKIP_NAMESPACES
+        for prefix in ("./", "/wiki/")
+    )
+)
+
+HEADING_LEVELS = {f"h{level}": level for level in range(1, 7)}
+# Elements whose text get_text("\n", strip=True) leaves out: script, style and template
+# bodies and ruby annotations (comments are skipped by itertext already)
+NON_TEXT_TAGS = ("script", "style", "template", "rt", "rp")
+_PARSER_OUTPUT_XPATH = 'descendant-or-self::div[contains(concat(" ", normalize-space(@class), " "), " mw-parser-output ")]'
+
+
+def get_data_dir() -> str:
+    """Find the data directory, checking scraper/data first, then project_root/data."""
+    scraper_data = os.path.join(PROJECT_ROOT, "scraper", "data")
+    root_data = os.path.join(PROJECT_ROOT, "data")
+    if os.path.exists(scraper_data):
+        return scraper_data
+    elif os.path.exists(root_data):
+        return root_data
+    else:
+        return scraper_data
+
+
+# -------------------- Checkpoints -------------------- #
+
+def checkpoint_path(out_path: str) -> str:
+    """JSONL sidecar that records are appended to until `out_path` is written."""
+    return out_path + ".partial.jsonl"
+
+
+def load_checkpoint_records(out_path: str) -> List[Dict]:
+    """Records appended to the JSONL checkpoint by an interrupted run."""
+    records: List[Dict] = []
+    partial_path = checkpoint_path(out_path)
+    if os.path.exists(partial_path):
+        try:
+            with open(partial_path, "rb") as f:
+                for line in f:
+                    try:
+                        records.append(orjson.loads(line))
+                    except orjson.JSONDecodeError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+        except IOError as e:
+            print(f"⚠️  Warning: Could not read checkpoint {partial_path}: {e}")
+    return records
+
+
+def load_checkpointed(out_path: str, key: str) -> Tuple[Set[str], List[Dict]]:
+    """
+    Load already harvested records in one pass: the JSON array at `out_path` plus any
+    records checkpointed by an interrupted run. Records are identified by their `key`
+    field; checkpointed ones only fill in names the array does not have yet.
+    Returns (processed names, records).
+    """
+    records: List[Dict] = []
+    if os.path.exists(out_path):
+        try:
+            with open(out_path, "rb") as f:
+                data = orjson.loads(f.read())
+                if isinstance(data, list):
+                    records = data
+        except (orjson.JSONDecodeError, IOError) as e:
+            print(f"⚠️  Warning: Could not read existing file {out_path}: {e}")
+    
+    processed = {rec[key] for rec in records if isinstance(rec.get(key), str)}
+    for rec in load_checkpoint_records(out_path):
+        name = rec.get(key)
+        if isinstance(name, str) and name not in processed:
+            processed.add(name)
+            records.append(rec)
+    return processed, records
+
+
+def save_checkpointed(out_path: str, records: List[Dict]) -> None:
+    """Write the consolidated JSON array and drop the checkpoint it supersedes."""
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(records, option=orjson.OPT_INDENT_2))
+    partial_path = checkpoint_path(out_path)
+    if os.path.exists(partial_path):
+        os.remove(partial_path)
+
+
+def map_checkpointed(
+    work: Callable[[str], Dict],
+    items: List[str],
+    out_path: str,
+    records: List[Dict],
+    workers: int,
+    **progress,
+) -> int:
+    """
+    Run `work` over `items` on a thread pool. Records come back in order and, on this
+    thread only, are appended to `records` and to the JSONL checkpoint (O(1) per record;
+    the JSON array is written once by save_checkpointed). Ctrl-C cancels the items not
+    yet started; checkpointed records are resumed by the next run. `progress` goes to tqdm.
+    Returns the number of new records.
+    """
+    new_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(checkpoint_path(out_path), "ab") as checkpoint:
+        results = executor.map(work, items)
+        try:
+            for rec in tqdm(results, total=len(items), **progress):
+                records.append(rec)
+                new_count += 1
+                
+                checkpoint.write(orjson.dumps(rec) + b"\n")
+                checkpoint.flush()
+        except KeyboardInterrupt:
+            # map() queued every item up front; drop the ones not started so shutdown
+            # only waits for the work in flight
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+    return new_count
+
+
+# -------------------- Links -------------------- #
+
+@lru_cache(maxsize=8192)
+def href_to_title(href: str, base_url: str) -> Optional[str]:
+    """
+    Turn a wiki link href into a normalized page title, or None for non-article links.
+    Cached because list pages link the same titles from several places.
+    """
+    if not href:
+        return None
+
+    # Handle relative paths (./), absolute (/wiki/...), and full URLs
+    wiki_path = None
+    if href.startswith("./"):
+        wiki_path = "/wiki/" + href[2:]
+    elif href.startswith("/wiki/"):
+        wiki_path = href
+    elif base_url in href and "/wiki/" in href:
+        wiki_path = "/wiki/" + href.split("/wiki/", 1)[1]
+
+    # Skip special pages
+    if not wiki_path or wiki_path.startswith(SKIP_PREFIXES):
+        return None
+
+    # Extract page title from href
+    title_part = wiki_path.replace("/wiki/", "").split("#")[0]
+    if not title_part:
+        return None
+
+    return decode_title(title_part)
+
+
+@lru_cache(maxsize=8192)
+def decode_title(title_part: str) -> Optional[str]:
+    """
+    URL-decode and normalize the title part of a wiki path. Cached separately from
+    href_to_title so "./X", "/wiki/X#Section" and full URLs share one decode.
+    unquote already returns %-free parts (most wiki hrefs) without decoding them.
+    """
+    title = unquote(title_part).replace("_", " ")
+    if not title:
+        return None
+
+    return upper_first(title)
+
+
+@lru_cache(maxsize=16384)
+def upper_first(title: str) -> str:
+    """
+    MediaWiki title normalization: first letter uppercase. One slice covers empty
+    and one-letter titles; cached because list pages repeat titles across tables and navboxes.
+    """
+    return title[:1].upper() + title[1:]
+
+
+def find_table_streaming(html: str, required_classes: FrozenSet[str]) -> Optional[lxml.etree._Element]:
+    """
+    First <table> whose class tokens include `required_classes`, found with iterparse.
+    Parsing stops as soon as the table closes, so the rest of the page is never
+    built; rows of skipped top-level tables are cleared as they close.
+    """
+    events = lxml.etree.iterparse(
+        io.BytesIO(html.encode("utf-8")), events=("end",), tag="table", html=True, encoding="utf-8"
+    )
+    for _, table in events:
+        if required_classes <= frozenset((table.get("class") or "").split()):
+            return table
+        # Nested tables stay intact: an enclosing table may still be the match
+        if next(table.iterancestors("table"), None) is None:
+            table.clear()
+    return None
+
+
+def strip_non_text(element: lxml.etree._Element) -> None:
+    """
+    Empty every NON_TEXT_TAGS element under `element` in place. The emptied elements
+    stay in the tree so the text before and after them remain separate itertext
+    strings, as get_text("\n", strip=True) keeps them; strip_elements would glue them.
+    """
+    for non_text in list(element.iter(*NON_TEXT_TAGS)):
+        non_text.clear(keep_tail=True)
+
+
+def paragraph_texts_streaming(html: str) -> Iterator[str]:
+    """
+    Non-empty text of every <p> in `html`, yielded while iterparse reads the page, with
+    NON_TEXT_TAGS left out as page_blocks does. Each paragraph and the siblings before
+    it are dropped once read, so the whole tree is never held in memory.
+    """
+    events = lxml.etree.iterparse(
+        io.BytesIO(html.encode("utf-8")), events=("end",), tag="p", html=True, encoding="utf-8"
+    )
+    for _, p in events:
+        strip_non_text(p)
+        text = element_text(p)
+        if text:
+            yield text
+        p.clear(keep_tail=True)
+        while p.getprevious() is not None:
+            del p.getparent()[0]
+
+
+# -------------------- Sections and text -------------------- #
+
+def element_text(element: lxml.etree._Element) -> str:
+    """Stripped text nodes of `element` joined by newlines, as get_text("\\n", strip=True)."""
+    return "\n".join(part.strip() for part in element.itertext() if part.strip())
+
+
+def paragraph_texts(elements: Iterable[lxml.etree._Element]) -> List[str]:
+    """
+    Non-empty text of every <p> in `elements`, in document order. NON_TEXT_TAGS are
+    emptied first (in place), so callers need not have stripped the tree themselves.
+    """
+    texts = []
+    for element in elements:
+        strip_non_text(element)
+        for p in element.iter("p"):
+            text = element_text(p)
+            if text:
+                texts.append(text)
+    return texts
+
+
+def heading_info(element: lxml.html.HtmlElement) -> Optional[Tuple[int, str]]:
+    """
+    (level, text) if `element` is a section heading, else None. Also accepts the
+    div.mw-heading wrapper newer MediaWiki versions put around h2-h6.
+    """
+    if element.tag == "div" and "mw-heading" in (element.get("class") or "").split():
+        element = next((child for child in element if child.tag in HEADING_LEVELS), None)
+        if element is None:
+            return None
+    level = HEADING_LEVELS.get(element.tag)
+    if level is None:
+        return None
+    headline = element.find_class("mw-headline")
+    return level, (headline[0] if headline else element).text_content().strip()
+
+
+def page_blocks(page_html: str) -> Tuple[List[lxml.html.HtmlElement], List[Optional[Tuple[int, str]]]]:
+    """
+    Top-level blocks of a page's parser output, each paired with its heading_info.
+    The headings double as the page TOC, so no separate sections request is needed.
+    """
+    # The parse API returns a bare fragment (div.mw-parser-output); parse it as one
+    # under a synthetic parent instead of letting lxml guess document vs fragment
+    tree = lxml.html.fragment_fromstring(page_html, create_parent=True)
+    # Text extraction skips what get_text("\n", strip=True) skips
+    strip_non_text(tree)
+    containers = tree.xpath(_PARSER_OUTPUT_XPATH)
+    blocks = list((containers[0] if containers else tree).iterchildren(tag=lxml.etree.Element))
+    return blocks, [heading_info(block) for block in blocks]
+
+
+def section_end(infos: List[Optional[Tuple[int, str]]], position: int) -> int:
+    """
+    Index of the first block after the heading at `position` that closes its section
+    (the next heading of the same or higher level), as a per-section API fetch ends.
+    """
+    level = infos[position][0]
+    return next(
+        (i for i in range(position + 1, len(infos)) if infos[i] is not None and infos[i][0] <= level),
+        len(infos),
+    )
@@ -1,31 +1,23 @@
 # scripts/extract_summaries.py
 from __future__ import annotations
 import os
-import json
+import re
+import orjson
 from typing import Dict, List, Optional, Set
 from urllib.parse import unquote
 from tqdm import tqdm
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup, SoupStrainer
+import lxml.html
 
 # Add project root to Python path
 import sys
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, project_root)
 
+from scraper.pipeline.harvest.cache import cached_page_html
 from scraper.pipeline.harvest.mediawiki import MediaWikiClient
+from scraper.pipeline.harvest.wiki_html import SKIP_PREFIXES, get_data_dir, upper_first
 
-# Helper to find data directory (check scraper/data first, then project_root/data)
-def get_data_dir():
-    """Find the data directory, checking scraper/data first, then project_root/data."""
-    scraper_data = os.path.join(project_root, "scraper", "data")
-    root_data = os.path.join(project_root, "data")
-    if os.path.exists(scraper_data):
-        return scraper_data
-    elif os.path.exists(root_data):
-        return root_data
-    else:
-        # Default to scraper/data if neither exists (will be created)
-        return scraper_data
 
 # The three list pages to process
 LIST_PAGES = {
@@ -34,6 +26,17 @@ LIST_PAGES = {
     "world_quests": "World_Quest/List",
 }
 
+# Link extraction only needs the content containers, lists and anchors; skipping
+# everything else (infobox images, navboxes, scripts) keeps the parsed tree small.
+QUEST_LINKS_STRAINER = SoupStrainer(["div", "ul", "a"])
+
+# Section-name matchers (case-insensitive substring search, one pass per name)
+SUMMARY_SECTION_RE = re.compile(r"summary|synopsis|plot|overview|description", re.IGNORECASE)
+CHARACTERS_SECTION_RE = re.compile(r"characters?|cast", re.IGNORECASE)
+
+MW_PARSER_OUTPUT_XPATH = '//div[contains(concat(" ", normalize-space(@class), " "), " mw-parser-output ")]'
+MW_HEADLINE_XPATH = './/span[contains(concat(" ", normalize-space(@class), " "), " mw-headline ")]'
+
 
 def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
     """
@@ -42,14 +45,12 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
     Specifically targets links inside <ul> lists for Story and World Quests.
     Returns a set of page titles (normalized).
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml", parse_only=QUEST_LINKS_STRAINER)
     titles = set()
     
     # Find all links in the main content area
-    # Handle multiple CSS classes (e.g., "mw-content-ltr mw-parser-output")
-    content_area = (soup.find("div", class_="mw-parser-output") or 
-                    soup.find("div", class_=lambda x: bool(x and ("mw-parser-output" in (x if isinstance(x, str) else " ".join(x) if isinstance(x, list) else str(x))))) or
-                    soup.find("div", id="content"))
+    # Class selectors match a single token, so "mw-content-ltr mw-parser-output" is covered too
+    content_area = soup.select_one("div.mw-parser-output") or soup.select_one("div#content")
     if not content_area:
         # If no content area found, try searching the entire document
         print("⚠️  Warning: No mw-parser-output or content div found, searching entire document")
@@ -88,14 +89,11 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
         "too_short": [],
         "valid": []
     }
+    raw_title_parts: Set[str] = set()
     
     for link in links_to_process:
-        href_attr = link.get("href")
-        # Convert to string if it's a list (BeautifulSoup can return lists)
-        if isinstance(href_attr, list):
-            href = str(href_attr[0]) if href_attr else ""
-        else:
-            href = str(href_attr) if href_attr else ""
+        # href is never multi-valued in BeautifulSoup (only class/rel-style attributes are)
+        href = link.get("href", "") or ""
         
         # Handle relative paths (./), absolute (/wiki/...), and full URLs (https://.../wiki/...)
         wiki_path = None
@@ -114,13 +112,7 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
             continue
         
         # Skip external links, anchors, and special pages
-        if (wiki_path.startswith("/wiki/File:") or 
-            wiki_path.startswith("/wiki/Category:") or 
-            wiki_path.startswith("/wiki/Template:") or
-            wiki_path.startswith("/wiki/User:") or
-            wiki_path.startswith("/wiki/Help:") or
-            wiki_path.startswith("/wiki/Special:") or
-            wiki_path.startswith("/wiki/MediaWiki:")):
+        if wiki_path.startswith(SKIP_PREFIXES):
             if len(skipped_reasons["special_page"]) < 3:
                 skipped_reasons["special_page"].append(wiki_path[:60])
             continue
@@ -132,6 +124,11 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
                 skipped_reasons["empty_title"].append(wiki_path[:60])
             continue
         
+        raw_title_parts.add(title_part)
+    
+    # Wiki pages link the same target many times (tables, navboxes, succession boxes),
+    # so decode and filter each distinct raw title only once
+    for title_part in raw_title_parts:
         # URL decode and normalize
         title = unquote(title_part).replace("_", " ")
         
@@ -165,8 +162,8 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
         
         # MediaWiki title normalization: first letter uppercase
         if title:
-            title = title[0].upper() + title[1:] if len(title) > 1 else title.upper()
-            titles.add(title)
+            title = upper_first(title)
+            titles.add(sys.intern(title))
             if len(skipped_reasons["valid"]) < 5:
                 skipped_reasons["valid"].append(title)
     
@@ -201,26 +198,20 @@ def extract_quest_links_from_html(html: str, base_url: str) -> Set[str]:
     return titles
 
 
-def extract_quest_links_from_section(section_element, base_url: str) -> Set[str]:
+def extract_quest_links_from_section(section_elements: List[lxml.html.HtmlElement], base_url: str) -> Set[str]:
     """
-    Extract quest links from a specific HTML section element.
+    Extract quest links from the lxml elements that make up one HTML section.
     Used for targeting specific sections like "List of Archon Quests".
     """
     titles = set()
-    if not section_element:
+    if not section_elements:
         print("⚠️  Section element is None or empty")
         return titles
     
-    all_links = section_element.find_all("a", href=True)
-    print(f"🔍 Found {len(all_links)} links in section")
+    all_hrefs = [href for element in section_elements for href in element.xpath("descendant-or-self::a/@href")]
+    print(f"🔍 Found {len(all_hrefs)} links in section")
     
-    for link in all_links:
-        href_attr = link.get("href")
-        if isinstance(href_attr, list):
-            href = str(href_attr[0]) if href_attr else ""
-        else:
-            href = str(href_attr) if href_attr else ""
-        
+    for href in all_hrefs:
         # Handle relative paths (./), absolute (/wiki/...), and full URLs (https://.../wiki/...)
         wiki_path = None
         if href.startswith("./"):
@@ -235,12 +226,7 @@ def extract_quest_links_from_section(section_element, base_url: str) -> Set[str]
             continue
         
         # Skip special pages
-        if (wiki_path.startswith("/wiki/File:") or 
-            wiki_path.startswith("/wiki/Category:") or 
-            wiki_path.startswith("/wiki/Template:") or
-            wiki_path.startswith("/wiki/User:") or
-            wiki_path.startswith("/wiki/Help:") or
-            wiki_path.startswith("/wiki/Special:")):
+        if wiki_path.startswith(SKIP_PREFIXES):
             continue
         
         title_part = wiki_path.replace("/wiki/", "").split("#")[0]
@@ -252,33 +238,32 @@ def extract_quest_links_from_section(section_element, base_url: str) -> Set[str]
         if title and not any(skip in title.lower() for skip in skip_patterns):
             # Skip very short titles
             if len(title.strip()) >= 3:
-                title = title[0].upper() + title[1:] if len(title) > 1 else title.upper()
+                title = upper_first(title)
                 titles.add(title)
     
     print(f"✅ Extracted {len(titles)} quest titles from section")
     return titles
 
 
-def extract_summary_section(mw: MediaWikiClient, title: str) -> Optional[str]:
+def extract_summary_section(
+    mw: MediaWikiClient, title: str, sections: Optional[Dict[str, str]] = None
+) -> Optional[str]:
     """
     Extract the Summary section from a quest page using MediaWiki API.
     More reliable than parsing HTML. Uses API to get sections and extract summary text.
+    Pass `sections` (from page_sections_via_api) to skip re-fetching the section list.
     Returns None if no Summary section is found.
     """
     # Get all sections via API
-    sections = mw.page_sections_via_api(title)
+    if sections is None:
+        sections = mw.page_sections_via_api(title)
     if not sections:
         return None
     
     # Find Summary section (case-insensitive)
-    summary_keywords = ("summary", "synopsis", "plot", "overview", "description", "quest description")
-    summary_index = None
-    
-    for section_name, section_idx in sections.items():
-        section_name_lower = section_name.lower()
-        if any(keyword in section_name_lower for keyword in summary_keywords):
-            summary_index = section_idx
-            break
+    summary_index = next(
+        (idx for name, idx in sections.items() if SUMMARY_SECTION_RE.search(name)), None
+    )
     
     if not summary_index:
         return None
@@ -288,26 +273,25 @@ def extract_summary_section(mw: MediaWikiClient, title: str) -> Optional[str]:
     return summary_text
 
 
-def extract_characters_section(mw: MediaWikiClient, title: str) -> Optional[str]:
+def extract_characters_section(
+    mw: MediaWikiClient, title: str, sections: Optional[Dict[str, str]] = None
+) -> Optional[str]:
     """
     Extract the Characters section from a quest page using MediaWiki API.
     More reliable than parsing HTML. Uses API to get sections and extract characters text.
+    Pass `sections` (from page_sections_via_api) to skip re-fetching the section list.
     Returns None if no Characters section is found.
     """
     # Get all sections via API
-    sections = mw.page_sections_via_api(title)
+    if sections is None:
+        sections = mw.page_sections_via_api(title)
     if not sections:
         return None
     
     # Find Characters section (case-insensitive)
-    character_keywords = ("characters", "character", "cast", "characters involved", "characters in quest")
-    characters_index = None
-    
-    for section_name, section_idx in sections.items():
-        section_name_lower = section_name.lower()
-        if any(keyword in section_name_lower for keyword in character_keywords):
-            characters_index = section_idx
-            break
+    characters_index = next(
+        (idx for name, idx in sections.items() if CHARACTERS_SECTION_RE.search(name)), None
+    )
     
     if not characters_index:
         return None
@@ -334,6 +318,7 @@ def extract_summaries(mw: Optional[MediaWikiClient] = None):
     data_dir = get_data_dir()
     summaries_dir = os.path.join(data_dir, "interim", "summaries")
     os.makedirs(summaries_dir, exist_ok=True)
+    list_page_cache_dir = os.path.join(data_dir, "interim", "cache", "list_pages")
     
     for quest_type, list_page_title in LIST_PAGES.items():
         print(f"\n{'='*60}")
@@ -342,52 +327,48 @@ def extract_summaries(mw: Optional[MediaWikiClient] = None):
         
         # Fetch the list page
         print(f"📄 Fetching list page: {list_page_title}")
-        list_page_html = mw.page_html(list_page_title)
+        list_page_html = cached_page_html(
+            list_page_cache_dir, mw.base_url, list_page_title, lambda: mw.page_html(list_page_title)
+        )
         if not list_page_html:
             print(f"⚠️  Could not fetch list page: {list_page_title}")
             continue
         
         # For Archon Quest, try to find the "List of Archon Quests" section
         if quest_type == "archon_quests":
-            soup = BeautifulSoup(list_page_html, "html.parser")
-            content_area = soup.find("div", class_="mw-parser-output") or soup.find("div", id="content")
+            tree = lxml.html.fromstring(list_page_html)
+            content_areas = tree.xpath(MW_PARSER_OUTPUT_XPATH) or tree.xpath('//div[@id="content"]')
+            content_area = content_areas[0] if content_areas else None
             
-            if content_area:
+            if content_area is not None:
                 # Look for h2 or h3 with "List of Archon Quests" text
-                headings = content_area.find_all(["h2", "h3"])
+                headings = list(content_area.iter("h2", "h3"))
                 print(f"🔍 Found {len(headings)} h2/h3 headings in Archon Quest page")
                 list_section_found = False
                 
                 for heading in headings:
                     # Check for mw-headline span first
-                    headline_span = heading.find("span", class_="mw-headline")
-                    if headline_span:
-                        heading_text = headline_span.get_text(strip=True).lower()
-                    else:
-                        heading_text = heading.get_text(strip=True).lower()
+                    headline_spans = heading.xpath(MW_HEADLINE_XPATH)
+                    headline = headline_spans[0] if headline_spans else heading
+                    heading_text = " ".join(headline.text_content().split()).lower()
                     
                     print(f"  Checking heading: '{heading_text[:50]}...'")
                     
                     if "list of archon quests" in heading_text:
                         print(f"✅ Found 'List of Archon Quests' section")
-                        # Extract all links from the section between this heading and the next
-                        # Get all elements after this heading until next h2/h3
-                        section_container = soup.new_tag("div")
-                        current = heading.next_sibling
-                        elements_collected = 0
-                        
-                        while current is not None:
-                            if isinstance(current, Tag):
-                                if current.name in ["h2", "h3"]:
-                                    break
-                                section_container.append(current)
-                                elements_collected += 1
-                            current = current.next_sibling
+                        # Collect the elements between this heading and the next h2/h3
+                        section_elements = []
+                        for sibling in heading.itersiblings():
+                            if not isinstance(sibling.tag, str):
+                                continue  # comments / processing instructions
+                            if sibling.tag in ("h2", "h3"):
+                                break
+                            section_elements.append(sibling)
                         
-                        print(f"  Collected {elements_collected} elements from section")
+                        print(f"  Collected {len(section_elements)} elements from section")
                         
-                        if section_container:
-                            extracted_links = extract_quest_links_from_section(section_container, mw.base_url)
+                        if section_elements:
+                            extracted_links = extract_quest_links_from_section(section_elements, mw.base_url)
                             if extracted_links:
                                 quest_titles = extracted_links
                                 list_section_found = True
@@ -421,26 +402,33 @@ def extract_summaries(mw: Optional[MediaWikiClient] = None):
         # Load existing summaries if file exists (for resuming interrupted runs)
         if os.path.exists(output_file):
             try:
-                with open(output_file, "r", encoding="utf-8") as f:
-                    existing_data = json.load(f)
+                with open(output_file, "rb") as f:
+                    existing_data = orjson.loads(f.read())
                     if isinstance(existing_data, list):
                         summaries_data = existing_data
-                        existing_titles = {item.get("title") for item in summaries_data}
+                        # Immutable snapshot of interned titles; only used for membership tests
+                        existing_titles = frozenset(
+                            sys.intern(item["title"]) for item in summaries_data if isinstance(item.get("title"), str)
+                        )
                         # Filter out already processed titles
-                        quest_titles = {t for t in quest_titles if t not in existing_titles}
+                        quest_titles = quest_titles - existing_titles
                         print(f"📂 Resuming: Found {len(summaries_data)} existing summaries, {len(quest_titles)} remaining")
-            except (json.JSONDecodeError, IOError):
+            except (orjson.JSONDecodeError, IOError):
                 print(f"⚠️  Could not load existing file, starting fresh")
         
         save_interval = 10  # Save every 10 summaries
         
         for title in tqdm(quest_titles, desc=f"Extracting summaries and characters from {quest_type}"):
+            # One section-list call per page, shared by the summary and characters lookups
+            # (action=parse only accepts a single page, so this is the cheapest it gets)
+            sections = mw.page_sections_via_api(title)
             # Extract summary section via API (no need to fetch HTML separately)
-            summary = extract_summary_section(mw, title)
-            # Also extract characters section from the same page
-            characters = extract_characters_section(mw, title)
+            summary = extract_summary_section(mw, title, sections)
             
             if summary:
+                # Also extract characters section from the same page
+                characters = extract_characters_section(mw, title, sections)
+
                 quest_data = {
                     "title": title,
                     "url": mw.canonical_url(mw.base_url, title),
@@ -454,14 +442,14 @@ def extract_summaries(mw: Optional[MediaWikiClient] = None):
                 
                 # Save incrementally every N summaries
                 if len(summaries_data) % save_interval == 0:
-                    with open(output_file, "w", encoding="utf-8") as f:
-                        json.dump(summaries_data, f, ensure_ascii=False, indent=2)
+                    with open(output_file, "wb") as f:
+                        f.write(orjson.dumps(summaries_data, option=orjson.OPT_INDENT_2))
             else:
                 skipped_count += 1
         
         # Final save
-        with open(output_file, "w", encoding="utf-8") as f:
-            json.dump(summaries_data, f, ensure_ascii=False, indent=2)
+        with open(output_file, "wb") as f:
+            f.write(orjson.dumps(summaries_data, option=orjson.OPT_INDENT_2))
         
         print(f"✅ Saved {len(summaries_data)} summaries to {output_file}")
         print(f"⏭️  Skipped {skipped_count} pages (no summary found or page not found)")
@@ -6,10 +6,10 @@ Script to:
 """
 from __future__ import annotations
 import os
-import json
 import sys
 import hashlib
-from collections import defaultdict
+import orjson
+from collections import Counter, defaultdict
 from pathlib import Path
 
 # Add project root to Python path
@@ -19,11 +19,16 @@ sys.path.insert(0, project_root)
 SRC_DIR = "data/interim"
 SUMMARIES_DIR = os.path.join(SRC_DIR, "summaries")
 JSONL_DIR = "data/jsonl"
+WRITE_BUFFER_SIZE = 1 << 20
+WRITE_CHUNK_LINES = 20000
+
+# Single-pass replacement table for sanitize_title (drops double quotes)
+_SANITIZE_TABLE = str.maketrans({" ": "_", "/": "_", "\\": "_", '"': None})
 
 
 def sanitize_title(title: str) -> str:
     """Convert title to ID-safe format."""
-    return title.lower().replace(' ', '_').replace('/', '_').replace('\\', '_').replace('"', '')
+    return title.lower().translate(_SANITIZE_TABLE)
 
 
 def add_ids_to_summaries():
@@ -32,7 +37,8 @@ def add_ids_to_summaries():
         print(f"❌ Summaries directory not found: {SUMMARIES_DIR}")
         return
     
-    summary_files = [f for f in os.listdir(SUMMARIES_DIR) if f.endswith("_summaries.json")]
+    with os.scandir(SUMMARIES_DIR) as it:
+        summary_files = [entry for entry in it if entry.name.endswith("_summaries.json")]
     
     if not summary_files:
         print(f"❌ No summary JSON files found in {SUMMARIES_DIR}")
@@ -42,14 +48,15 @@ def add_ids_to_summaries():
     print("Adding IDs to Summary JSON Files")
     print("=" * 60)
     
-    for fname in summary_files:
+    for entry in summary_files:
+        fname = entry.name
         corpus = fname.replace("_summaries.json", "")
-        src_path = os.path.join(SUMMARIES_DIR, fname)
+        src_path = entry.path
         
         print(f"\n📝 Processing {fname}...")
         
-        with open(src_path, "r", encoding="utf-8") as f:
-            summaries = json.load(f)
+        with open(src_path, "rb") as f:
+            summaries = orjson.loads(f.read())
         
         updated_count = 0
         for rec in summaries:
@@ -64,8 +71,8 @@ def add_ids_to_summaries():
         
         if updated_count > 0:
             # Write back to file
-            with open(src_path, "w", encoding="utf-8") as f:
-                json.dump(summaries, f, ensure_ascii=False, indent=2)
+            with open(src_path, "wb") as f:
+                f.write(orjson.dumps(summaries, option=orjson.OPT_INDENT_2))
             print(f"  ✅ Added IDs to {updated_count} entries")
         else:
             print(f"  ℹ️  All entries already have IDs")
@@ -73,13 +80,24 @@ def add_ids_to_summaries():
     print(f"\n✅ Finished processing summary files")
 
 
+def _iter_records(path: str):
+    """Yield parsed records from a JSONL file, reporting and skipping malformed lines."""
+    with open(path, "rb") as f:
+        for line_num, line in enumerate(f, 1):
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError as e:
+                print(f"  ⚠️  Error parsing line {line_num}: {e}")
+
+
 def fix_duplicate_ids_in_jsonl():
     """Fix duplicate IDs in JSONL files by making them unique."""
     if not os.path.exists(JSONL_DIR):
         print(f"❌ JSONL directory not found: {JSONL_DIR}")
         return
     
-    jsonl_files = [f for f in os.listdir(JSONL_DIR) if f.endswith(".jsonl")]
+    with os.scandir(JSONL_DIR) as it:
+        jsonl_files = [entry for entry in it if entry.name.endswith(".jsonl")]
     
     if not jsonl_files:
         print(f"❌ No JSONL files found in {JSONL_DIR}")
@@ -89,30 +107,25 @@ def fix_duplicate_ids_in_jsonl():
     print("Fixing Duplicate IDs in JSONL Files")
     print("=" * 60)
     
-    for fname in jsonl_files:
-        src_path = os.path.join(JSONL_DIR, fname)
+    for entry in jsonl_files:
+        fname = entry.name
+        src_path = entry.path
         temp_path = src_path + ".tmp"
         
         print(f"\n📝 Processing {fname}...")
         
-        # Track ID usage and duplicates
-        id_counts = defaultdict(int)
-        records = []
-        
-        # First pass: read all records and identify duplicates
-        with open(src_path, "r", encoding="utf-8") as f:
-            for line_num, line in enumerate(f, 1):
-                try:
-                    rec = json.loads(line)
-                    records.append(rec)
-                    old_id = rec.get("id", "")
-                    id_counts[old_id] += 1
-                except json.JSONDecodeError as e:
-                    print(f"  ⚠️  Error parsing line {line_num}: {e}")
-                    continue
+        # First pass: count, per ID, how many records share each 8-char hash suffix;
+        # Counter consumes the record generator directly and nothing is kept in memory
+        suffix_counts: Counter[tuple] = Counter(
+            (rec.get("id", ""), (rec.get("text_hash") or "")[:8])
+            for rec in _iter_records(src_path)
+        )
+        id_counts: Counter[str] = Counter()
+        for (rec_id, _suffix), count in suffix_counts.items():
+            id_counts[rec_id] += count
         
         # Identify duplicates
-        duplicates = {id_val: count for id_val, count in id_counts.items() if count > 1}
+        duplicates = frozenset(id_val for id_val, count in id_counts.items() if count > 1)
         
         if not duplicates:
             print(f"  ℹ️  No duplicate IDs found")
@@ -120,62 +133,51 @@ def fix_duplicate_ids_in_jsonl():
         
         print(f"  🔍 Found {len(duplicates)} duplicate ID(s)")
         
-        # Second pass: assign unique IDs
-        # Group records by old_id to process duplicates together
-        records_by_old_id = defaultdict(list)
-        for idx, rec in enumerate(records):
-            old_id = rec.get("id", "")
-            records_by_old_id[old_id].append((idx, rec))
-        
-        id_sequences = defaultdict(int)  # Track sequence number for each base ID
-        seen_new_ids = set()  # Track all new IDs to ensure uniqueness
+        # Group sizes are known up front, so each (old_id, hash suffix) group gets
+        # its IDs from a running counter: no retry loop, no set of assigned IDs
+        group_sizes = {key: count for key, count in suffix_counts.items() if key[0] in duplicates}
+        del suffix_counts
+        group_seq = defaultdict(int)
+        updated_count = 0
         
-        for old_id, rec_list in records_by_old_id.items():
-            if old_id not in duplicates:
-                # Not a duplicate, keep original ID
-                seen_new_ids.add(old_id)
-                continue
-            
-            # Process duplicates: assign unique IDs using hash + sequence
-            for idx, rec in rec_list:
-                text_hash = rec.get("text_hash", "")
+        # Second pass: stream records to the temp file, rewriting only duplicate IDs;
+        # every other line is copied through without a JSON round-trip. Output is
+        # handed to writelines in chunks over a 1 MB buffer rather than per record
+        buf = []
+        with open(src_path, "rb") as fin, open(temp_path, "wb", buffering=WRITE_BUFFER_SIZE) as fout:
+            for line in fin:
+                if len(buf) >= WRITE_CHUNK_LINES:
+                    fout.writelines(buf)
+                    buf.clear()
                 
-                # Build candidate ID with hash suffix
-                if text_hash:
-                    hash_suffix = text_hash[:8]
-                    base_candidate = f"{old_id}:{hash_suffix}"
-                else:
-                    hash_suffix = ""
-                    base_candidate = old_id
+                try:
+                    rec = orjson.loads(line)
+                except orjson.JSONDecodeError:
+                    # Already reported in the first pass; malformed lines are dropped
+                    continue
                 
-                # Check if base candidate is unique
-                if base_candidate not in seen_new_ids:
-                    candidate_id = base_candidate
-                else:
-                    # Need to add sequence number for uniqueness
-                    id_sequences[old_id] += 1
-                    if hash_suffix:
-                        candidate_id = f"{old_id}:{hash_suffix}:seq{id_sequences[old_id]}"
-                    else:
-                        candidate_id = f"{old_id}:seq{id_sequences[old_id]}"
+                old_id = rec.get("id", "")
+                if old_id not in duplicates:
+                    buf.append(line if line.endswith(b"\n") else line + b"\n")
+                    continue
                 
-                # Final check: ensure absolute uniqueness
-                while candidate_id in seen_new_ids:
-                    id_sequences[old_id] += 1
-                    if hash_suffix:
-                        candidate_id = f"{old_id}:{hash_suffix}:seq{id_sequences[old_id]}"
-                    else:
-                        candidate_id = f"{old_id}:seq{id_sequences[old_id]}"
+                # Process duplicates: hash suffix alone if it is unique for this ID,
+                # otherwise hash suffix + sequence number. The suffix and ID prefix
+                # are built once per record and only the seq tail varies.
+                suffix = (rec.get("text_hash") or "")[:8]
+                prefix = f"{old_id}:{suffix}" if suffix else old_id
+                group = (old_id, suffix)
                 
-                seen_new_ids.add(candidate_id)
-                rec["id"] = candidate_id
-        
-        # Write updated records
-        updated_count = sum(id_counts[id_val] for id_val in duplicates)
-        
-        with open(temp_path, "w", encoding="utf-8") as f:
-            for rec in records:
-                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+                if group_sizes[group] == 1:
+                    rec["id"] = prefix
+                else:
+                    group_seq[group] += 1
+                    rec["id"] = f"{prefix}:seq{group_seq[group]}"
+                
+                updated_count += 1
+                buf.append(orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE))
+            
+            fout.writelines(buf)
         
         # Replace original file
         os.replace(temp_path, src_path)
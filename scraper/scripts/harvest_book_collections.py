@@ -1,11 +1,11 @@
 # scripts/harvest_book_collections.py
 from __future__ import annotations
 import os
-import json
+import re
 import sys
-from typing import Set, List, Dict, Optional
-from urllib.parse import unquote
+from typing import Set, List, Dict, Optional, Tuple
 from tqdm import tqdm
+import lxml.html
 from bs4 import BeautifulSoup
 
 # Add project root to path for importing modules
@@ -14,18 +14,25 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from scraper.pipeline.harvest.mediawiki import MediaWikiClient, MediaWikiError
+from scraper.pipeline.harvest.cache import cached_page_html
+from scraper.pipeline.harvest.wiki_html import (
+    ARTICLE_LINK_PREDICATE,
+    checkpoint_path,
+    find_table_streaming,
+    get_data_dir,
+    href_to_title,
+    load_checkpointed,
+    map_checkpointed,
+    page_blocks,
+    paragraph_texts,
+    save_checkpointed,
+    section_end,
+)
 
 
-def get_data_dir():
-    """Find the data directory, checking scraper/data first, then project_root/data."""
-    scraper_data = os.path.join(project_root, "scraper", "data")
-    root_data = os.path.join(project_root, "data")
-    if os.path.exists(scraper_data):
-        return scraper_data
-    elif os.path.exists(root_data):
-        return root_data
-    else:
-        return scraper_data
+BOOK_TABLE_CLASSES = frozenset({"article-table", "sortable"})
+# First article link in each row's second cell (the Title/Name column)
+TITLE_CELL_HREF_XPATH = f".//tr/td[2]/descendant::a[@href]{ARTICLE_LINK_PREDICATE}[1]/@href"
 
 
 def extract_book_links_from_table(html: str, base_url: str) -> Set[str]:
@@ -35,190 +42,79 @@ def extract_book_links_from_table(html: str, base_url: str) -> Set[str]:
     and extracts links from the Title column.
     Returns a set of page titles (normalized).
     """
-    soup = BeautifulSoup(html, "html.parser")
     titles = set()
     
-    # Find the table with the specified class
-    def has_table_classes(classes):
-        if not classes:
-            return False
-        class_str = " ".join(classes) if isinstance(classes, list) else str(classes)
-        return "article-table" in class_str and "sortable" in class_str
-    
-    table = soup.find("table", class_=has_table_classes)
-    if not table:
+    # Find the table with the specified classes (exact class tokens)
+    table = find_table_streaming(html, BOOK_TABLE_CLASSES)
+    if table is None:
         print("⚠️  Warning: Could not find article-table sortable table")
         return titles
     
     # Find all rows in tbody
     tbody = table.find("tbody")
-    if not tbody:
+    if tbody is None:
         print("⚠️  Warning: Could not find tbody in table")
         return titles
     
-    rows = tbody.find_all("tr")
-    print(f"🔍 Found {len(rows)} rows in book collections table")
+    print(f"🔍 Found {len(tbody.findall('.//tr'))} rows in book collections table")
     
-    for row in rows:
-        # The Title column is typically the second column (index 1)
-        cells = row.find_all("td")
-        if len(cells) < 2:
-            continue
-        
-        # Look for links in the Title column (second cell)
-        title_cell = cells[1]
-        link = title_cell.find("a", href=True)
-        if not link:
-            continue
-        
-        href_attr = link.get("href", "")
-        # Convert to string if it's a list (BeautifulSoup can return lists)
-        if isinstance(href_attr, list):
-            href = str(href_attr[0]) if href_attr else ""
-        else:
-            href = str(href_attr) if href_attr else ""
-        
-        if not href:
-            continue
-        
-        # Extract page title from href
-        # Handle relative paths (./), absolute (/wiki/...), and full URLs
-        wiki_path = None
-        if href.startswith("./"):
-            wiki_path = "/wiki/" + href[2:]
-        elif href.startswith("/wiki/"):
-            wiki_path = href
-        elif base_url in href and "/wiki/" in href:
-            wiki_path = "/wiki/" + href.split("/wiki/", 1)[1]
-        
-        if not wiki_path:
-            continue
-        
-        # Skip special pages
-        if (wiki_path.startswith("/wiki/File:") or 
-            wiki_path.startswith("/wiki/Category:") or 
-            wiki_path.startswith("/wiki/Template:") or
-            wiki_path.startswith("/wiki/User:") or
-            wiki_path.startswith("/wiki/Help:") or
-            wiki_path.startswith("/wiki/Special:")):
-            continue
-        
-        # Extract page title from href
-        title_part = wiki_path.replace("/wiki/", "").split("#")[0]
-        if not title_part:
-            continue
-        
-        # URL decode and normalize
-        title = unquote(title_part).replace("_", " ")
-        
-        # MediaWiki title normalization: first letter uppercase
+    # The Title column is the second cell; take the first link in it, as plain strings
+    for href in tbody.xpath(TITLE_CELL_HREF_XPATH):
+        title = href_to_title(href, base_url)
         if title:
-            title = title[0].upper() + title[1:] if len(title) > 1 else title.upper()
             titles.add(title)
     
     return titles
 
 
+# The "Other Books" section heading: matched by its anchor id (any case), or by
+# headline text only if that fails, since text matching has to read every span.
+# REST (Parsoid) HTML puts the id on the heading itself and has no mw-headline span.
+OTHER_BOOKS_ANCHOR_SELECTOR = 'span[id="Other_Books" i]'
+OTHER_BOOKS_HEADING_SELECTORS = (
+    ':is(h2, h3)[id="Other_Books" i]',
+    f":is(h2, h3):has({OTHER_BOOKS_ANCHOR_SELECTOR})",
+    ':is(h2, h3):has(span.mw-headline:-soup-contains("Other Books"))',
+)
+# Text-node fallback; a compiled pattern is matched without a Python callback per node
+OTHER_BOOKS_TEXT_RE = re.compile("Other Books")
+
+
 def extract_other_books_links(html: str, base_url: str) -> Set[str]:
     """
     Extract book page titles from the "Other Books" section on the Book page.
     Finds the h2 heading with "Other Books" text or span with id "Other_Books" and extracts links from the table below it.
     Returns a set of page titles (normalized).
     """
-    soup = BeautifulSoup(html, "html.parser")
+    soup = BeautifulSoup(html, "lxml")
     titles = set()
     
-    # Find the "Other Books" heading - try multiple approaches
-    other_books_heading = None
-    
-    # First, try finding by span id "Other_Books" (case-insensitive)
-    other_books_span = soup.find("span", id="Other_Books")
-    if not other_books_span:
-        # Try case-insensitive search
-        for span in soup.find_all("span", id=True):
-            if span.get("id", "").lower() == "other_books":
-                other_books_span = span
-                break
-    
-    if other_books_span:
-        # Find the parent heading (h2 or h3)
-        other_books_heading = other_books_span.find_parent(["h2", "h3"])
-    
-    # If not found, try searching for any span containing "Other Books" text
-    if not other_books_heading:
-        for span in soup.find_all("span"):
-            span_text = span.get_text(strip=True)
-            if span_text == "Other Books" or "Other Books" in span_text:
-                other_books_heading = span.find_parent(["h2", "h3"])
-                if other_books_heading:
-                    break
-    
-    # If still not found, try the mw-headline approach
-    if not other_books_heading:
-        for heading in soup.find_all(["h2", "h3"]):
-            headline = heading.find("span", class_="mw-headline")
-            if headline:
-                heading_text = headline.get_text(strip=True)
-                if "Other Books" in heading_text:
-                    other_books_heading = heading
-                    break
-    
-    # If we still don't have a heading but found a span earlier, try to find table from span's parent
-    if not other_books_heading and not other_books_span:
-        # Try to find the span one more time by text
-        for span in soup.find_all("span"):
-            span_text = span.get_text(strip=True)
-            if span_text == "Other Books":
-                other_books_span = span
-                # Try to get parent heading one more time
-                other_books_heading = span.find_parent(["h2", "h3"])
-                if other_books_heading:
-                    break
-    
-    # Last resort: search for all tables and find one that's near "Other Books" text
-    fallback_table = None
-    if not other_books_heading and not other_books_span:
-        # Search for any element containing "Other Books" and find nearby table
-        for element in soup.find_all(text=lambda text: text and "Other Books" in text):
-            parent = element.parent
-            # Look for table in siblings or nearby
-            for sibling in parent.find_next_siblings():
-                if sibling.name == "table":
-                    fallback_table = sibling
-                    other_books_heading = parent.find_parent(["h2", "h3"])
-                    break
-            if fallback_table:
-                break
-    
-    if not other_books_heading and not other_books_span and not fallback_table:
-        print("⚠️  Warning: Could not find 'Other Books' heading or span")
-        return titles
-    
-    # Find the table that follows the heading or span
-    # If we found a fallback table, use it directly
-    if fallback_table:
-        table = fallback_table
+    # A selector pass finds the section heading; its table is the next sibling
+    # table, unless another heading comes first (the section has no table then)
+    other_books_heading = next(
+        (heading for heading in map(soup.select_one, OTHER_BOOKS_HEADING_SELECTORS) if heading is not None),
+        None,
+    )
+    if other_books_heading is not None:
+        table = other_books_heading.find_next_sibling(["table", "h2", "h3"])
     else:
-        # Look for the next table element after the heading/span
-        if other_books_heading:
-            current = other_books_heading.find_next_sibling()
+        # Anchor span outside a regular heading: take the next table in document order
+        other_books_span = soup.select_one(OTHER_BOOKS_ANCHOR_SELECTOR)
+        if other_books_span is not None:
+            table = other_books_span.find_next("table")
         else:
-            # If we only have the span, find its parent and then search from there
-            parent = other_books_span.find_parent()
-            current = parent.find_next_sibling() if parent else other_books_span.find_next_sibling()
-        
-        table = None
-        
-        while current:
-            if current.name == "table":
-                table = current
-                break
-            # Stop if we hit another h2 heading (next section)
-            if current.name in ["h2", "h3"]:
-                break
-            current = current.find_next_sibling()
-    
-    if not table:
+            # Last resort, only when neither a heading nor an anchor exists: any text
+            # mentioning "Other Books" with a table among its parent's later siblings
+            table = None
+            for node in soup.find_all(string=OTHER_BOOKS_TEXT_RE):
+                table = node.parent.find_next_sibling("table")
+                if table is not None:
+                    break
+            if table is None:
+                print("⚠️  Warning: Could not find 'Other Books' heading or span")
+                return titles
+    
+    if table is None or table.name != "table":
         print("⚠️  Warning: Could not find table under 'Other Books' section")
         return titles
     
@@ -242,190 +138,148 @@ def extract_other_books_links(html: str, base_url: str) -> Set[str]:
         if not link:
             continue
         
-        href_attr = link.get("href", "")
-        # Convert to string if it's a list (BeautifulSoup can return lists)
-        if isinstance(href_attr, list):
-            href = str(href_attr[0]) if href_attr else ""
-        else:
-            href = str(href_attr) if href_attr else ""
-        
-        if not href:
-            continue
-        
-        # Extract page title from href
-        # Handle relative paths (./), absolute (/wiki/...), and full URLs
-        wiki_path = None
-        if href.startswith("./"):
-            wiki_path = "/wiki/" + href[2:]
-        elif href.startswith("/wiki/"):
-            wiki_path = href
-        elif base_url in href and "/wiki/" in href:
-            wiki_path = "/wiki/" + href.split("/wiki/", 1)[1]
-        
-        if not wiki_path:
-            continue
-        
-        # Skip special pages
-        if (wiki_path.startswith("/wiki/File:") or 
-            wiki_path.startswith("/wiki/Category:") or 
-            wiki_path.startswith("/wiki/Template:") or
-            wiki_path.startswith("/wiki/User:") or
-            wiki_path.startswith("/wiki/Help:") or
-            wiki_path.startswith("/wiki/Special:")):
-            continue
-        
-        # Extract page title from href
-        title_part = wiki_path.replace("/wiki/", "").split("#")[0]
-        if not title_part:
-            continue
-        
-        # URL decode and normalize
-        title = unquote(title_part).replace("_", " ")
-        
-        # MediaWiki title normalization: first letter uppercase
+        title = href_to_title(link.get("href") or "", base_url)
         if title:
-            title = title[0].upper() + title[1:] if len(title) > 1 else title.upper()
             titles.add(title)
     
     return titles
 
 
-def get_section_html_via_api(mw: MediaWikiClient, title: str, section_index: str) -> Optional[str]:
-    """
-    Get a specific section's HTML via MediaWiki API.
-    Similar to page_section_text_via_api but returns HTML instead of plain text.
-    """
-    params = {
-        "action": "parse",
-        "page": title,
-        "prop": "text",
-        "section": section_index,
-        "format": "json",
-        "formatversion": "2",
-    }
-    
-    try:
-        resp = mw._request("GET", mw.api_url, params=params)
-        data = resp.json()
-        
-        parse_data = data.get("parse", {})
-        if "missing" in parse_data or "error" in data:
-            return None
-            
-        html = parse_data.get("text", "")
-        return html if html else None
-    except (MediaWikiError, KeyError, ValueError):
-        return None
-
-
-def extract_vol_sections(mw: MediaWikiClient, title: str) -> List[Dict[str, str]]:
+def extract_vol_sections(
+    blocks: List[lxml.html.HtmlElement],
+    infos: List[Optional[Tuple[int, str]]],
+) -> List[Dict[str, str]]:
     """
-    Extract text content under h2 headings that contain "Vol" text using MediaWiki API.
-    The h2 headings have class "mw-headline".
-    All text is inside <p> tags.
+    Extract text content under headings that contain "Vol" text.
+    Each Vol section runs until the next heading of the same or higher level.
+    All text is inside <p> tags. `blocks`/`infos` come from page_blocks.
     Returns a list of dicts with 'volume' (heading text) and 'content' (text under heading).
     """
     volumes = []
     
-    # Get all sections via API
-    sections = mw.page_sections_via_api(title)
-    if not sections:
-        return volumes
-    
-    # Find sections that contain "Vol" in their name
-    vol_sections = {name: idx for name, idx in sections.items() if "Vol" in name}
-    
-    for vol_name, section_idx in vol_sections.items():
-        # Get the section HTML via API
-        section_html = get_section_html_via_api(mw, title, section_idx)
-        if not section_html:
+    # Later duplicates of a heading replace earlier content, as a {name: index} TOC did
+    contents: Dict[str, str] = {}
+    for position, info in enumerate(infos):
+        if info is None or "Vol" not in info[1]:
             continue
+        vol_name = info[1]
         
-        # Parse HTML and extract text from <p> tags
-        soup = BeautifulSoup(section_html, "html.parser")
-        paragraphs = soup.find_all("p")
-        
-        # Extract text from all <p> tags
-        content_parts = []
-        for p in paragraphs:
-            text = p.get_text("\n", strip=True)
-            if text:
-                content_parts.append(text)
+        # Text from <p> tags up to the end of the section
+        content_parts = paragraph_texts(blocks[position + 1:section_end(infos, position)])
         
-        content = "\n\n".join(content_parts) if content_parts else ""
-        
-        if content.strip():
+        contents[vol_name] = "\n\n".join(content_parts).strip()
+    
+    for vol_name, content in contents.items():
+        if content:
             volumes.append({
                 "volume": vol_name,
-                "content": content.strip()
+                "content": content
             })
     
     return volumes
 
 
-def extract_text_section(mw: MediaWikiClient, title: str) -> Optional[str]:
+# "book text" headings are covered by the "text" substring
+TEXT_SECTION_KEYWORDS = ("text", "content")
+
+
+def extract_text_section(
+    blocks: List[lxml.html.HtmlElement],
+    infos: List[Optional[Tuple[int, str]]],
+) -> Optional[str]:
     """
-    Extract the Text section from a book page using MediaWiki API.
-    More reliable than parsing HTML. Uses API to get sections and extract text content.
+    Extract the Text section from a book page: all of its text, heading included,
+    as the API returns for that section on its own. `blocks`/`infos` come from page_blocks.
     Returns None if no Text section is found.
     """
-    # Get all sections via API
-    sections = mw.page_sections_via_api(title)
-    if not sections:
-        return None
-    
-    # Find Text section (case-insensitive)
-    text_keywords = ("text", "book text", "content")
-    text_index = None
-    
-    for section_name, section_idx in sections.items():
-        section_name_lower = section_name.lower()
-        if any(keyword in section_name_lower for keyword in text_keywords):
-            # Prefer exact "Text" match, but accept any containing "text"
-            if section_name_lower == "text":
-                text_index = section_idx
-                break
-            elif text_index is None:  # Use first match if no exact match found
-                text_index = section_idx
-    
-    if not text_index:
+    # Find Text section (case-insensitive): an exact "Text" heading wins and stops the
+    # scan; otherwise take the first section whose name contains a keyword
+    lowered = [(position, info[1].lower()) for position, info in enumerate(infos) if info is not None]
+    text_position = next((position for position, name in lowered if name == "text"), None)
+    if text_position is None:
+        text_position = next(
+            (position for position, name in lowered if any(keyword in name for keyword in TEXT_SECTION_KEYWORDS)),
+            None,
+        )
+    
+    if text_position is None:
         return None
     
-    # Get the text section content via API
-    text_content = mw.page_section_text_via_api(title, text_index)
-    return text_content
+    return "\n".join(
+        part.strip()
+        for block in blocks[text_position:section_end(infos, text_position)]
+        for part in block.itertext()
+        if part.strip()
+    )
 
 
-def load_processed_books(out_path: str) -> Set[str]:
-    """Load book titles that have already been processed from the JSON file."""
-    processed = set()
-    if os.path.exists(out_path):
-        try:
-            with open(out_path, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    for rec in data:
-                        if "title" in rec:
-                            processed.add(rec["title"])
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"⚠️  Warning: Could not read existing file {out_path}: {e}")
-    return processed
+def process_book(mw: MediaWikiClient, book_title: str, cache_dir: Optional[str] = None) -> Dict[str, str]:
+    """
+    Fetch one book page and build its record. Runs on a worker thread, so it never
+    raises MediaWikiError (the client has already retried with backoff by then).
+    Warnings go through tqdm.write so they don't break up the progress bar.
+    API responses are cached under `cache_dir` when given.
+    """
+    text = ""
+    
+    # Determine if this is a book collection (has Vol sections) or other book (has Text section).
+    # One page fetch serves both: sections are sliced locally from its headings.
+    try:
+        page_html = cached_page_html(cache_dir, mw.base_url, book_title, lambda: mw.page_html_via_api(book_title))
+        blocks, infos = page_blocks(page_html) if page_html else ([], [])
+        # Try Vol sections first (for book collections)
+        volumes = extract_vol_sections(blocks, infos)
+        if volumes:
+            # Combine all volumes' content into a single text field
+            text_parts = []
+            for vol in volumes:
+                vol_name = vol.get("volume", "")
+                vol_content = vol.get("content", "")
+                if vol_content:
+                    if vol_name:
+                        text_parts.append(f"{vol_name}\n\n{vol_content}")
+                    else:
+                        text_parts.append(vol_content)
+            
+            text = "\n\n".join(text_parts) if text_parts else ""
+        else:
+            # If no Vol sections, try Text section (for other books)
+            text = extract_text_section(blocks, infos) or ""
+            if not text.strip():
+                tqdm.write(f"⚠️  Warning: No Vol sections or Text section found in {book_title}")
+    except MediaWikiError as e:
+        tqdm.write(f"⚠️  Warning: Failed to fetch {book_title} after retries: {e}")
+        text = ""
+    
+    # Create record matching summaries format (but with "text" instead of "summary")
+    return {
+        "title": book_title,
+        "url": mw.canonical_url(mw.base_url, book_title),
+        "text": text.strip() if text else "",
+    }
 
 
 def main():
+    # Book fetches are network-bound; the client's rate limiter is shared by all workers,
+    # so throughput tops out at HARVEST_RPS no matter how many workers run
+    workers = max(1, int(os.getenv("HARVEST_WORKERS", "8")))
     mw = MediaWikiClient(
         user_agent=os.getenv("USER_AGENT", "genshin-rag/1.0 (contact: ajoshuauc@gmail.com)"),
         base_url=os.getenv("WIKI_BASE", "https://genshin-impact.fandom.com"),
+        rate_limit_rps=float(os.getenv("HARVEST_RPS", "2.0")),
+        pool_maxsize=workers,
     )
     
     data_dir = get_data_dir()
     summaries_dir = os.path.join(data_dir, "interim", "summaries")
     os.makedirs(summaries_dir, exist_ok=True)
+    # Parse API pages are cached so re-runs and resumes skip the network
+    cache_dir = os.path.join(data_dir, "interim", "cache", "book_pages")
     
     out_path = os.path.join(summaries_dir, "book_collections_summaries.json")
     
     # Load already processed books
-    processed = load_processed_books(out_path)
+    processed, book_data = load_checkpointed(out_path, "title")
     print(f"📋 Found {len(processed)} already processed book collections")
     
     # Fetch the Book page
@@ -461,76 +315,28 @@ def main():
     if skipped > 0:
         print(f"⏭️  Skipping {skipped} already processed books")
     
-    # Load existing data if file exists (for resuming interrupted runs)
-    book_data: List[Dict] = []
-    if os.path.exists(out_path):
-        try:
-            with open(out_path, "r", encoding="utf-8") as f:
-                existing_data = json.load(f)
-                if isinstance(existing_data, list):
-                    book_data = existing_data
-                    existing_titles = {item.get("title") for item in book_data}
-                    # Filter out already processed titles
-                    remaining = [t for t in remaining if t not in existing_titles]
-                    print(f"📂 Resuming: Found {len(book_data)} existing entries, {len(remaining)} remaining")
-        except (json.JSONDecodeError, IOError):
-            print(f"⚠️  Could not load existing file, starting fresh")
-    
     if not remaining:
+        if os.path.exists(checkpoint_path(out_path)):
+            save_checkpointed(out_path, book_data)
         print(f"✅ All {len(all_book_titles)} books already processed → {out_path}")
         return
     
-    # Process each book
-    new_count = 0
-    save_interval = 10  # Save every N books
-    
-    for book_title in tqdm(remaining, desc="Processing books", unit="book"):
-        text = ""
-        
-        # Determine if this is a book collection (has Vol sections) or other book (has Text section)
-        # Try Vol sections first (for book collections)
-        try:
-            volumes = extract_vol_sections(mw, book_title)
-            if volumes:
-                # Combine all volumes' content into a single text field
-                text_parts = []
-                for vol in volumes:
-                    vol_name = vol.get("volume", "")
-                    vol_content = vol.get("content", "")
-                    if vol_content:
-                        if vol_name:
-                            text_parts.append(f"{vol_name}\n\n{vol_content}")
-                        else:
-                            text_parts.append(vol_content)
-                
-                text = "\n\n".join(text_parts) if text_parts else ""
-            else:
-                # If no Vol sections, try Text section (for other books)
-                text = extract_text_section(mw, book_title) or ""
-                if not text.strip():
-                    print(f"⚠️  Warning: No Vol sections or Text section found in {book_title}")
-        except MediaWikiError as e:
-            print(f"⚠️  Warning: Failed to fetch {book_title} after retries: {e}")
-            text = ""
-        
-        # Create record matching summaries format (but with "text" instead of "summary")
-        rec = {
-            "title": book_title,
-            "url": mw.canonical_url(mw.base_url, book_title),
-            "text": text.strip() if text else "",
-        }
-        
-        book_data.append(rec)
-        new_count += 1
-        
-        # Save incrementally every N books
-        if len(book_data) % save_interval == 0:
-            with open(out_path, "w", encoding="utf-8") as f:
-                json.dump(book_data, f, ensure_ascii=False, indent=2)
+    # Process books concurrently; each record is checkpointed as it arrives and the
+    # JSON array is written once at the end
+    new_count = map_checkpointed(
+        lambda title: process_book(mw, title, cache_dir),
+        remaining,
+        out_path,
+        book_data,
+        workers,
+        desc="Processing books",
+        unit="book",
+        # No bar redraws when output is redirected to a log file (CI, nohup)
+        disable=not sys.stderr.isatty(),
+    )
     
     # Final save
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(book_data, f, ensure_ascii=False, indent=2)
+    save_checkpointed(out_path, book_data)
     
     print(f"✅ Processed {new_count} new books ({skipped} skipped, {len(all_book_titles)} total) → {out_path}")
 
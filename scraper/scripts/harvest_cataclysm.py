@@ -1,10 +1,9 @@
 # scripts/harvest_cataclysm.py
 from __future__ import annotations
 import os
-import json
 import sys
-from typing import List, Dict, Optional
-from bs4 import BeautifulSoup
+from typing import List, Dict
+import orjson
 
 # Add project root to path for importing modules
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,96 +11,47 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from scraper.pipeline.harvest.mediawiki import MediaWikiClient, MediaWikiError
-
-
-def get_data_dir():
-    """Find the data directory, checking scraper/data first, then project_root/data."""
-    scraper_data = os.path.join(project_root, "scraper", "data")
-    root_data = os.path.join(project_root, "data")
-    if os.path.exists(scraper_data):
-        return scraper_data
-    elif os.path.exists(root_data):
-        return root_data
-    else:
-        return scraper_data
-
-
-def get_section_html_via_api(mw: MediaWikiClient, title: str, section_index: str) -> Optional[str]:
-    """
-    Get a specific section's HTML via MediaWiki API.
-    """
-    params = {
-        "action": "parse",
-        "page": title,
-        "prop": "text",
-        "section": section_index,
-        "format": "json",
-        "formatversion": "2",
-    }
-    
-    try:
-        resp = mw._request("GET", mw.api_url, params=params)
-        data = resp.json()
-        
-        parse_data = data.get("parse", {})
-        if "missing" in parse_data or "error" in data:
-            return None
-            
-        html = parse_data.get("text", "")
-        return html if html else None
-    except (MediaWikiError, KeyError, ValueError):
-        return None
+from scraper.pipeline.harvest.wiki_html import get_data_dir, page_blocks, paragraph_texts, section_end
 
 
 def extract_all_p_tags(mw: MediaWikiClient, title: str) -> List[Dict[str, str]]:
     """
     Extract all <p> tags from the page, organized by section.
+    The page HTML is fetched once and sliced locally: like a section fetched on its
+    own, each section runs until the next heading of the same or higher level.
     Returns a list of dicts with 'section' (heading text) and 'content' (text from p tags).
     """
     results = []
     
-    # Get all sections via API
-    sections = mw.page_sections_via_api(title)
-    if not sections:
-        # If no sections, try getting the whole page
-        html = mw.page_html(title)
-        if html:
-            soup = BeautifulSoup(html, "html.parser")
-            paragraphs = soup.find_all("p")
-            content_parts = []
-            for p in paragraphs:
-                text = p.get_text("\n", strip=True)
-                if text:
-                    content_parts.append(text)
-            if content_parts:
-                results.append({
-                    "section": "Main",
-                    "content": "\n\n".join(content_parts)
-                })
+    page_html = mw.page_html_via_api(title)
+    if not page_html:
         return results
     
-    # Process each section
-    for section_name, section_idx in sections.items():
-        section_html = get_section_html_via_api(mw, title, section_idx)
-        if not section_html:
+    blocks, infos = page_blocks(page_html)
+    
+    if not any(infos):
+        # If no sections, take every paragraph on the page
+        content_parts = paragraph_texts(blocks)
+        if content_parts:
+            results.append({
+                "section": "Main",
+                "content": "\n\n".join(content_parts)
+            })
+        return results
+    
+    # Later duplicates of a heading replace earlier content, as the {name: index} TOC did
+    contents: Dict[str, str] = {}
+    for position, info in enumerate(infos):
+        if info is None:
             continue
-        
-        # Parse HTML and extract text from <p> tags
-        soup = BeautifulSoup(section_html, "html.parser")
-        paragraphs = soup.find_all("p")
-        
-        content_parts = []
-        for p in paragraphs:
-            text = p.get_text("\n", strip=True)
-            if text:
-                content_parts.append(text)
-        
-        content = "\n\n".join(content_parts) if content_parts else ""
-        
-        if content.strip():
+        section_name = info[1]
+        contents[section_name] = "\n\n".join(paragraph_texts(blocks[position + 1:section_end(infos, position)])).strip()
+    
+    for section_name, content in contents.items():
+        if content:
             results.append({
                 "section": section_name,
-                "content": content.strip()
+                "content": content
             })
     
     return results
@@ -147,8 +97,8 @@ def main():
         ]
         
         # Save to JSON
-        with open(out_path, "w", encoding="utf-8") as f:
-            json.dump(output, f, ensure_ascii=False, indent=2)
+        with open(out_path, "wb") as f:
+            f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
         
         print(f"✅ Saved {len(output)} sections to {out_path}")
         
@@ -1,10 +1,9 @@
 # scripts/harvest_fatui.py
 from __future__ import annotations
 import os
-import json
 import sys
 from typing import List, Dict, Optional
-from bs4 import BeautifulSoup
+import orjson
 
 # Add project root to path for importing modules
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -12,18 +11,7 @@ if project_root not in sys.path:
     sys.path.insert(0, project_root)
 
 from scraper.pipeline.harvest.mediawiki import MediaWikiClient, MediaWikiError
-
-
-def get_data_dir():
-    """Find the data directory, checking scraper/data first, then project_root/data."""
-    scraper_data = os.path.join(project_root, "scraper", "data")
-    root_data = os.path.join(project_root, "data")
-    if os.path.exists(scraper_data):
-        return scraper_data
-    elif os.path.exists(root_data):
-        return root_data
-    else:
-        return scraper_data
+from scraper.pipeline.harvest.wiki_html import get_data_dir, paragraph_texts_streaming
 
 
 def extract_all_p_tags_text(mw: MediaWikiClient, title: str) -> str:
@@ -41,7 +29,8 @@ def extract_all_p_tags_text(mw: MediaWikiClient, title: str) -> str:
     
     try:
         resp = mw._request("GET", mw.api_url, params=params)
-        data = resp.json()
+        # orjson decodes the large escaped HTML string much faster than resp.json()
+        data = orjson.loads(resp.content)
         
         parse_data = data.get("parse", {})
         if "missing" in parse_data or "error" in data:
@@ -51,16 +40,9 @@ def extract_all_p_tags_text(mw: MediaWikiClient, title: str) -> str:
         if not html:
             return ""
         
-        soup = BeautifulSoup(html, "html.parser")
-        paragraphs = soup.find_all("p")
-        
-        content_parts = []
-        for p in paragraphs:
-            text = p.get_text("\n", strip=True)
-            if text:
-                content_parts.append(text)
-        
-        return "\n\n".join(content_parts) if content_parts else ""
+        # Paragraphs are read with iterparse and dropped as they are joined, so large
+        # pages never build a full tree; text matches get_text("\n", strip=True)
+        return "\n\n".join(paragraph_texts_streaming(html))
         
     except (MediaWikiError, KeyError, ValueError) as e:
         print(f"⚠️  API error for {title}: {e}")
@@ -108,8 +90,8 @@ def main():
         }]
     
     # Save to JSON
-    with open(out_path, "w", encoding="utf-8") as f:
-        json.dump(output, f, ensure_ascii=False, indent=2)
+    with open(out_path, "wb") as f:
+        f.write(orjson.dumps(output, option=orjson.OPT_INDENT_2))
     
     print(f"\n✅ Saved to {out_path}")
     print(f"   - {char_name}: {len(output[0]['text'])} chars")
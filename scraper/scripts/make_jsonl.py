@@ -1,9 +1,14 @@
 # scripts/make_jsonl.py
 from __future__ import annotations
-import os, json, hashlib
+import os, hashlib
 import sys
 import re
-from typing import Set, List
+import itertools
+import orjson
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from functools import lru_cache
+from typing import Callable, Deque, Iterable, Iterator, Optional, Set, List, Tuple
 
 # Add project root to Python path
 project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -31,6 +36,15 @@ SRC_DIR = os.path.join(data_dir, "interim")
 SUMMARIES_DIR = os.path.join(SRC_DIR, "summaries")
 MISC_DIR = os.path.join(SRC_DIR, "misc")
 DST_DIR = os.path.join(data_dir, "jsonl")
+# Chunk records are serialized into a list and handed to writelines in batches
+# over a 1 MB buffer rather than written one by one
+WRITE_BUFFER_SIZE = 1 << 20
+# NDJSON corpora are read through a buffer of the same size
+READ_BUFFER_SIZE = 1 << 20
+WRITE_CHUNK_LINES = 20000
+# Compiled once: sanitize_title runs for every record
+_SLUG_SEPARATOR_RE = re.compile(r'[^a-zA-Z0-9\-]+')
+_SECTION_RE = re.compile(r'\n## ')
 
 # Global set to track all IDs across all files to ensure uniqueness
 all_ids: Set[str] = set()
@@ -38,9 +52,14 @@ all_ids: Set[str] = set()
 # Initialize tiktoken encoder for text-embedding-3-small (uses cl100k_base encoding)
 encoding = tiktoken.get_encoding("cl100k_base")
 
+@lru_cache(maxsize=100_000)
 def count_tokens(text: str) -> int:
-    """Count tokens in text using tiktoken."""
-    return len(encoding.encode(text))
+    """
+    Count tokens in text using tiktoken. Memoized: the recursive splitter measures
+    the same pieces and merged candidates over and over while it packs chunks.
+    """
+    # Wiki text never carries special tokens; encode_ordinary skips scanning for them
+    return len(encoding.encode_ordinary(text))
 
 # LangChain text splitter optimized for text-embedding-3-small
 # Max tokens: 8191, target ~800 tokens per chunk with overlap
@@ -62,7 +81,8 @@ def create_unique_id(base_id: str) -> str:
     
     # First, truncate base_id if too long (before uniqueness check)
     if len(base_id) > MAX_LENGTH:
-        # Create a hash of the full ID for uniqueness (first 12 chars of MD5)
+        # Create a hash of the full ID for uniqueness (first 12 chars of MD5).
+        # IDs are Pinecone vector keys: changing this hash would orphan stored vectors.
         full_hash = hashlib.md5(base_id.encode('utf-8')).hexdigest()[:12]
         # Truncate to leave room for hash suffix (MAX_LENGTH - 1 for separator - 12 for hash)
         truncate_to = MAX_LENGTH - 13
@@ -89,17 +109,15 @@ def create_unique_id(base_id: str) -> str:
             return unique_id
         counter += 1
 
+@lru_cache(maxsize=4096)
 def sanitize_title(title: str) -> str:
-    """Sanitize title for use in IDs."""
-    # Normalize: lowercase, replace spaces/slashes with underscores
-    sanitized = title.lower().replace(" ", "_").replace("/", "_")
-    # Remove special characters, keep alphanumeric, underscore, dash
-    sanitized = re.sub(r'[^a-zA-Z0-9_\-]', '_', sanitized)
-    # Collapse multiple underscores
-    sanitized = re.sub(r'_+', '_', sanitized)
+    """Sanitize title for use in IDs. Cached: section names repeat across pages."""
+    # Lowercase, then turn every run of characters outside [a-z0-9-] (spaces, slashes,
+    # punctuation and existing underscores alike) into one underscore: the same result
+    # as replacing each one and collapsing the underscores afterwards, in one pass
+    sanitized = _SLUG_SEPARATOR_RE.sub('_', title.lower())
     # Remove leading/trailing underscores
-    sanitized = sanitized.strip('_')
-    return sanitized
+    return sanitized.strip('_')
 
 def parse_characters(characters_str: str) -> List[str]:
     """
@@ -131,46 +149,81 @@ def parse_characters(characters_str: str) -> List[str]:
     
     return character_names
 
-def process_ndjson_file(src: str, dst: str, corpus: str):
-    """Process NDJSON file with HTML content using LangChain chunking."""
+def split_sections(md: str) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (section name, body) for each "\n## " section of the markdown, both stripped.
+    A section's first line is its name; a section without one is named "Overview".
+    Sections are sliced straight out of `md` at the header offsets, in one pass.
+    """
+    start = 0
+    for end in itertools.chain((m.start() for m in _SECTION_RE.finditer(md)), (len(md),)):
+        name_end = md.find("\n", start, end)
+        if name_end == -1:
+            yield "Overview", md[start:end].strip()
+        else:
+            yield md[start:name_end].strip(), md[name_end + 1:end].strip()
+        start = end + len("\n## ")
+
+def markdown_for_line(line: bytes) -> Tuple[Optional[str], Optional[str], str]:
+    """
+    Decode one NDJSON line and convert its HTML, in a worker process. Returns
+    (title, url, markdown), or (None, None, error) so a bad line doesn't stop the map.
+    Only the fields the chunk loop needs travel back, not the page HTML.
+    """
+    try:
+        rec = orjson.loads(line)
+        return rec["title"], rec["url"], html_to_markdownish(rec["html"])
+    except Exception as e:
+        return None, None, str(e)
+
+def bounded_map(executor: Executor, fn: Callable, items: Iterable, window: int) -> Iterator:
+    """
+    executor.map, but with at most `window` items in flight: the next item is only read
+    and submitted once the oldest result is taken. Results come back in input order.
+    """
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def process_ndjson_file(src: str, dst: str, corpus: str) -> int:
+    """Process NDJSON file with HTML content using LangChain chunking. Returns the number of chunks written."""
     global all_ids
     
-    with open(src, encoding="utf-8") as fin, open(dst, "w", encoding="utf-8") as fout:
-        for line_num, line in enumerate(fin, start=1):
+    # html_to_markdownish (BeautifulSoup's pure-Python parser) holds the GIL, so pages are
+    # converted in worker processes; map hands them back in line order while this process
+    # chunks and writes. Binary lines go straight to orjson in the workers.
+    workers = max(1, int(os.getenv("MAKE_JSONL_WORKERS", str(os.cpu_count() or 1))))
+    with open(src, "rb", buffering=READ_BUFFER_SIZE) as fin, open(dst, "wb", buffering=WRITE_BUFFER_SIZE) as fout, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        buf: List[bytes] = []
+        count = 0
+        # A bounded window keeps only a few pages of HTML queued, not the whole file
+        pages = bounded_map(executor, markdown_for_line, fin, 4 * workers)
+        for line_num, (title, url, md) in enumerate(pages, start=1):
             try:
-                rec = json.loads(line)
-                md = html_to_markdownish(rec["html"])
+                if title is None:
+                    raise ValueError(md)
                 
-                # Split markdown by sections first (## headers)
-                sections = re.split(r'\n## ', md)
+                title_slug = sanitize_title(title)
                 
-                for section_idx, section_content in enumerate(sections):
-                    if not section_content.strip():
-                        continue
-                    
-                    # Extract section name
-                    if "\n" in section_content:
-                        section_name, body = section_content.split("\n", 1)
-                    else:
-                        section_name = "Overview"
-                        body = section_content
-                    
-                    section_name = section_name.strip()
-                    body = body.strip()
-                    
+                # Split markdown by sections first (## headers)
+                for section_name, body in split_sections(md):
                     if not body:
                         continue
                     
                     # Use LangChain to chunk the section body
                     chunks = text_splitter.split_text(body)
+                    section_slug = sanitize_title(section_name)
                     
                     for chunk_idx, chunk in enumerate(chunks):
                         if not chunk.strip():
                             continue
                         
                         # Create base ID
-                        title_slug = sanitize_title(rec['title'])
-                        section_slug = sanitize_title(section_name)
                         base_id = f"fandom:{corpus}:{title_slug}:{section_slug}:{chunk_idx}"
                         
                         # Ensure uniqueness
@@ -179,25 +232,33 @@ def process_ndjson_file(src: str, dst: str, corpus: str):
                         out = {
                             "id": unique_id,
                             "type": corpus,
-                            "title": rec["title"],
+                            "title": title,
                             "section": section_name,
-                            "source_url": rec["url"],
+                            "source_url": url,
                             "license": "CC BY-SA",
                             "lang": "en",
                             "text": chunk,
                             "text_hash": hashlib.sha1(chunk.encode("utf-8")).hexdigest(),
                         }
-                        fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+                        buf.append(orjson.dumps(out, option=orjson.OPT_APPEND_NEWLINE))
+                        count += 1
+                        if len(buf) >= WRITE_CHUNK_LINES:
+                            fout.writelines(buf)
+                            buf.clear()
             except Exception as e:
                 print(f"⚠️  Error processing line {line_num} in {src}: {e}")
                 continue
+        fout.writelines(buf)
+    return count
 
-def process_summary_file(src: str, dst: str, corpus: str):
-    """Process summary JSON file using LangChain chunking."""
+def process_summary_file(src: str, dst: str, corpus: str) -> int:
+    """Process summary JSON file using LangChain chunking. Returns the number of chunks written."""
     global all_ids
     
-    with open(src, encoding="utf-8") as fin, open(dst, "w", encoding="utf-8") as fout:
-        summaries = json.load(fin)
+    with open(src, "rb") as fin, open(dst, "wb", buffering=WRITE_BUFFER_SIZE) as fout:
+        buf: List[bytes] = []
+        count = 0
+        summaries = orjson.loads(fin.read())
         
         for rec in summaries:
             title = rec["title"]
@@ -214,13 +275,13 @@ def process_summary_file(src: str, dst: str, corpus: str):
             
             # Use LangChain to chunk the summary
             chunks = text_splitter.split_text(summary_text)
+            title_slug = sanitize_title(title)
             
             for chunk_idx, chunk in enumerate(chunks):
                 if not chunk.strip():
                     continue
                 
                 # Create base ID
-                title_slug = sanitize_title(title)
                 base_id = f"fandom:{corpus}_summaries:{title_slug}:summary:{chunk_idx}"
                 
                 # Ensure uniqueness
@@ -245,14 +306,25 @@ def process_summary_file(src: str, dst: str, corpus: str):
                 if characters_list:
                     out["characters"] = characters_list
                 
-                fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+                buf.append(orjson.dumps(out, option=orjson.OPT_APPEND_NEWLINE))
+                count += 1
+                if len(buf) >= WRITE_CHUNK_LINES:
+                    fout.writelines(buf)
+                    buf.clear()
+        fout.writelines(buf)
+    return count
 
-def process_misc_file(src: str, dst: str, corpus: str):
-    """Process miscellaneous JSON file that contains a list of {url, text, <name>} records."""
+def process_misc_file(src: str, dst: str, corpus: str) -> int:
+    """
+    Process miscellaneous JSON file that contains a list of {url, text, <name>} records.
+    Returns the number of chunks written.
+    """
     global all_ids
 
-    with open(src, encoding="utf-8") as fin, open(dst, "w", encoding="utf-8") as fout:
-        records = json.load(fin)
+    with open(src, "rb") as fin, open(dst, "wb", buffering=WRITE_BUFFER_SIZE) as fout:
+        buf: List[bytes] = []
+        count = 0
+        records = orjson.loads(fin.read())
         if not isinstance(records, list):
             raise ValueError(f"Expected a list in {src}, got {type(records).__name__}")
 
@@ -276,11 +348,11 @@ def process_misc_file(src: str, dst: str, corpus: str):
                 continue
 
             chunks = text_splitter.split_text(str(text))
+            title_slug = sanitize_title(str(title))
             for chunk_idx, chunk in enumerate(chunks):
                 if not chunk.strip():
                     continue
 
-                title_slug = sanitize_title(str(title))
                 base_id = f"fandom:{corpus}:{title_slug}:misc:{chunk_idx}"
                 unique_id = create_unique_id(base_id)
 
@@ -304,7 +376,46 @@ def process_misc_file(src: str, dst: str, corpus: str):
                     "text": chunk_with_title,
                     "text_hash": hashlib.sha1(text_for_hash.encode("utf-8")).hexdigest(),
                 }
-                fout.write(json.dumps(out, ensure_ascii=False) + "\n")
+                buf.append(orjson.dumps(out, option=orjson.OPT_APPEND_NEWLINE))
+                count += 1
+                if len(buf) >= WRITE_CHUNK_LINES:
+                    fout.writelines(buf)
+                    buf.clear()
+        fout.writelines(buf)
+    return count
+
+def process_corpus_file(process, src: str, dst: str, corpus: str) -> Tuple[int, Set[str]]:
+    """
+    Run one process_*_file in a worker process and return its chunk count and the IDs
+    it created. The worker's all_ids starts empty, so only this file's IDs come back.
+    """
+    all_ids.clear()
+    count = process(src, dst, corpus)
+    return count, set(all_ids)
+
+def reassign_clashing_ids(dst: str, clashes: Set[str]) -> int:
+    """
+    Give the records in `dst` whose IDs an earlier file already used new IDs (the
+    suffixed form from create_unique_id) and rewrite the file; other lines are copied
+    as-is. all_ids must already hold every ID in use. Returns the number renamed.
+    """
+    renamed = 0
+    tmp_path = dst + ".tmp"
+    with open(dst, "rb", buffering=READ_BUFFER_SIZE) as fin, open(tmp_path, "wb", buffering=WRITE_BUFFER_SIZE) as fout:
+        buf: List[bytes] = []
+        for line in fin:
+            rec = orjson.loads(line)
+            if rec["id"] in clashes:
+                rec["id"] = create_unique_id(rec["id"])
+                line = orjson.dumps(rec, option=orjson.OPT_APPEND_NEWLINE)
+                renamed += 1
+            buf.append(line)
+            if len(buf) >= WRITE_CHUNK_LINES:
+                fout.writelines(buf)
+                buf.clear()
+        fout.writelines(buf)
+    os.replace(tmp_path, dst)
+    return renamed
 
 def main():
     global all_ids
@@ -325,8 +436,8 @@ def main():
     #     src = os.path.join(SRC_DIR, fname)
     #     dst = os.path.join(DST_DIR, f"{corpus}.jsonl")
     #     print(f"📝 Processing {corpus}...")
-    #     process_ndjson_file(src, dst, corpus)
-    #     print(f"✅ Wrote {dst} ({len([l for l in open(dst, encoding='utf-8')])} chunks)")
+    #     count = process_ndjson_file(src, dst, corpus)
+    #     print(f"✅ Wrote {dst} ({count} chunks)")
     
     # # Process summary JSON files
     # if os.path.exists(SUMMARIES_DIR):
@@ -340,8 +451,8 @@ def main():
     #         src = os.path.join(SUMMARIES_DIR, fname)
     #         dst = os.path.join(DST_DIR, f"{corpus}_summaries.jsonl")
     #         print(f"📝 Processing {corpus} summaries...")
-    #         process_summary_file(src, dst, corpus)
-    #         print(f"✅ Wrote {dst} ({len([l for l in open(dst, encoding='utf-8')])} chunks)")
+    #         count = process_summary_file(src, dst, corpus)
+    #         print(f"✅ Wrote {dst} ({count} chunks)")
     
 
     # Process miscellaneous summary JSON files (non _summaries suffix)
@@ -351,13 +462,32 @@ def main():
             if fname.endswith(".json"):
                 misc_files.append(fname)
 
+        # Files are independent (every ID starts with its own corpus), so they are chunked
+        # in parallel processes; each worker returns the IDs it used for the global check
+        tasks = []
         for fname in sorted(misc_files):
             corpus = fname.replace(".json", "")
             src = os.path.join(MISC_DIR, fname)
             dst = os.path.join(DST_DIR, f"{corpus}.jsonl")
-            print(f"Processing {corpus} (misc summaries)...")
-            process_misc_file(src, dst, corpus)
-            print(f"Wrote {dst} ({len([l for l in open(dst, encoding='utf-8')])} chunks)")
+            tasks.append((src, dst, corpus))
+
+        workers = max(1, min(len(tasks), int(os.getenv("MAKE_JSONL_WORKERS", str(os.cpu_count() or 1)))))
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = []
+            for src, dst, corpus in tasks:
+                print(f"Processing {corpus} (misc summaries)...")
+                futures.append(executor.submit(process_corpus_file, process_misc_file, src, dst, corpus))
+
+            # Merge in file order: IDs an earlier file already used are renamed in the later
+            # file, so no two records reach Pinecone under the same ID
+            for (src, dst, corpus), future in zip(tasks, futures):
+                count, file_ids = future.result()
+                clashes = all_ids & file_ids
+                all_ids |= file_ids
+                if clashes:
+                    renamed = reassign_clashing_ids(dst, clashes)
+                    print(f"⚠️  Renamed {renamed} records in {dst} whose IDs an earlier file already used")
+                print(f"Wrote {dst} ({count} chunks)")
 
 
     print(f"\nTotal unique IDs created: {len(all_ids)}")
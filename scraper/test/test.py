@@ -1,5 +1,17 @@
+from __future__ import annotations
+
+import os
+import sys
+
 import requests
-from bs4 import BeautifulSoup
+import requests.adapters
+
+# Add project root to path for importing modules
+project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+if project_root not in sys.path:
+    sys.path.insert(0, project_root)
+
+from scraper.pipeline.harvest.wiki_html import page_blocks, section_end
 
 API_URL = "https://genshin-impact.fandom.com/api.php"
 PAGE_TITLE = "Pavo_Ocellus_Chapter"
@@ -12,16 +24,21 @@ HEADERS = {
 
 session = requests.Session()
 session.trust_env = False  # optional: ignore system proxy env vars
+# Keep-alive pool with retries, so repeated API calls reuse one TLS connection
+session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=3))
+session.headers["Accept-Encoding"] = "gzip, deflate"
 
 
-def get_sections(page_title: str) -> dict[str, str]:
+def get_page_html(page_title: str) -> str:
     """
-    Return {section_name: index} for the page.
+    Fetch the whole rendered page in one request (no section=, no edit links or TOC).
     """
     params = {
         "action": "parse",
         "page": page_title,
-        "prop": "sections",
+        "prop": "text",
+        "disableeditsection": "1",
+        "disabletoc": "1",
         "format": "json",
         "formatversion": "2",
     }
@@ -30,53 +47,51 @@ def get_sections(page_title: str) -> dict[str, str]:
     resp.raise_for_status()
 
     data = resp.json()
-    sections: dict[str, str] = {}
-    for sec in data["parse"]["sections"]:
-        line = sec["line"].strip()
-        idx = sec["index"]
-        sections[line] = idx
-    return sections
+    return data["parse"]["text"]
 
 
-def get_section_text(page_title: str, sec_index: str) -> str:
+def get_sections(html: str) -> dict[str, tuple[str, str]]:
     """
-    Fetch one section by index and return plain text.
+    Return {section_name: (section index, plain text)} for the page, sliced locally
+    from its HTML. The index is the MediaWiki section index (headings numbered from 1
+    in page order), and each section runs to the next heading of the same or higher
+    level and includes its heading, like a section fetched on its own with section=<index>.
     """
-    params = {
-        "action": "parse",
-        "page": page_title,
-        "prop": "text",
-        "section": sec_index,
-        "format": "json",
-        "formatversion": "2",
-    }
-
-    resp = session.get(API_URL, params=params, headers=HEADERS)
-    resp.raise_for_status()
-
-    data = resp.json()
-    html = data["parse"]["text"]
-    soup = BeautifulSoup(html, "html.parser")
-    return soup.get_text("\n", strip=True)
+    blocks, infos = page_blocks(html)
+
+    sections: dict[str, tuple[str, str]] = {}
+    index = 0
+    for position, info in enumerate(infos):
+        if info is None:
+            continue
+        index += 1
+        sections[info[1]] = str(index), "\n".join(
+            part.strip()
+            for block in blocks[position:section_end(infos, position)]
+            for part in block.itertext()
+            if part.strip()
+        )
+    return sections
 
 
 if __name__ == "__main__":
-    sections = get_sections(PAGE_TITLE)
+    # One request for the whole page; sections are sliced locally
+    sections = get_sections(get_page_html(PAGE_TITLE))
     print("Sections on page:")
-    for name, idx in sections.items():
+    for name, (idx, _) in sections.items():
         print(f"  {idx}: {name}")
 
     # Find "Summary" (exact or case-insensitive)
     summary_index = None
-    for name, idx in sections.items():
+    for name, (idx, text) in sections.items():
         if name.lower() == "summary":
             summary_index = idx
+            summary_text = text
             break
 
     if not summary_index:
         raise SystemExit("No 'Summary' section found")
 
-    summary_text = get_section_text(PAGE_TITLE, summary_index)
     print("\n=== SUMMARY ===\n")
     print(summary_text)
     print("\nSection index:", summary_index)